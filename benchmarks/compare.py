@@ -0,0 +1,48 @@
+'''
+Compares two benchmark result files written by benchmarks/run.py.
+
+Usage:
+    python3 benchmarks/compare.py before.json after.json
+
+Prints the best-of-N time for every (stage, scale) present in both files and
+the ratio after/before. Ratios above the --threshold (default 1.2) are flagged
+as regressions, and the exit status is 1 if there are any.
+'''
+
+import argparse
+import json
+import sys
+
+
+def _load(filename):
+    with open(filename) as f:
+        results = json.load(f)['results']
+    return {(r['stage'], r['scale']): r for r in results}
+
+
+def compare(before, after, threshold):
+    regressions = 0
+    for key in before:
+        if key not in after:
+            continue
+        stage, scale = key
+        b = before[key]['min']
+        a = after[key]['min']
+        ratio = a / b if b else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('{:>5}x {:<30} {:>10.4f}s {:>10.4f}s {:>7.2f}x{}'.format(scale, stage, b, a, ratio, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two benchmark runs.')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    args = parser.parse_args()
+
+    regressions = compare(_load(args.before), _load(args.after), args.threshold)
+    sys.exit(1 if regressions else 0)
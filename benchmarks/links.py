@@ -0,0 +1,168 @@
+'''
+Checks huts/links.py against a local stand-in server, so the link checker can
+be verified offline and without load on the real sites.
+
+The stand-in answers each trip report link (by a hash of its path) with one
+of: 200, 404, 410, a redirect to a login page, a redirect off the stand-in
+(which mustn't be followed), or 500. The links are checked
+into a temporary cache, which is then aged to exercise the TTLs:
+  - first check: every link is classified, the 404s/410s are dead but not yet
+    confirmed (so not hidden), and nothing is due,
+  - two days later: only the errors and unconfirmed dead links are due;
+    rechecking them confirms the dead ones, which are then hidden,
+  - ten days later: the private and dead links are due, but not the ok ones,
+  - outage: checking against an origin nothing listens on records nothing.
+
+Usage:
+    PYTHONPATH=. python3 benchmarks/links.py [--concurrency 8] [--latency 0.01]
+
+Exits with status 1 if any check fails.
+'''
+
+import argparse
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from huts.links import (
+    OK, PRIVATE, DEAD, ERROR,
+    LinkCache, LinkChecker, hide_dead_links, report_urls, DEFAULT_CONCURRENCY,
+)
+from huts.trips import all_trips
+
+LOGIN_PATH = '/accounts/login'
+
+# (response, the status huts.links should record for it)
+RESPONSES = [('200', OK), ('404', DEAD), ('410', DEAD), ('login', PRIVATE), ('offsite', ERROR),
+             ('500', ERROR)]
+# where the offsite redirects go; the checker must not follow them
+OFFSITE_ORIGIN = 'http://offsite.invalid'
+
+
+def _response(path):
+    digest = hashlib.sha256(path.encode('utf-8')).digest()
+    return RESPONSES[digest[0] % len(RESPONSES)]
+
+
+def expected_status(url):
+    parts = urlsplit(url)
+    return _response(parts.path + ('?' + parts.query if parts.query else ''))[1]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if self.path.startswith(LOGIN_PATH):
+            response = '200'
+        else:
+            response, _ = _response(self.path)
+        if response in ('login', 'offsite'):
+            self.send_response(302)
+            if response == 'login':
+                self.send_header('Location', '{}?next={}'.format(LOGIN_PATH, self.path))
+            else:
+                self.send_header('Location', OFFSITE_ORIGIN + self.path)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = response.encode('ascii')
+        self.send_response(int(response))
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(latency):
+    '''Starts the stand-in server in a thread. Returns it; its origin is
+    http://127.0.0.1:<server.server_port>.'''
+    handler = type('Handler', (StandInHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _unused_origin():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    return 'http://127.0.0.1:{}'.format(port)
+
+
+def _age(cache, days):
+    for entry in cache.links.values():
+        entry['checked'] -= days * 86400
+
+
+def run(concurrency, latency):
+    server = serve(latency)
+    origin = 'http://127.0.0.1:{}'.format(server.server_port)
+    urls = report_urls(all_trips())
+    expected = {url: expected_status(url) for url in urls}
+    dead = set(url for url, status in expected.items() if status == DEAD)
+    private = set(url for url, status in expected.items() if status == PRIVATE)
+    unsettled = set(url for url, status in expected.items() if status in (ERROR, DEAD))
+    failures = []
+
+    def check(description, ok):
+        print('{:<60} {}'.format(description, 'ok' if ok else 'FAILED'))
+        if not ok:
+            failures.append(description)
+
+    def due(cache, status=None):
+        return set(url for url in urls if cache.is_due(url) and (status is None or expected[url] == status))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = LinkCache(os.path.join(cache_dir, 'link_status.json'))
+        checker = LinkChecker(cache, origin, concurrency, host_interval=0)
+
+        start = time.perf_counter()
+        results = checker.check(urls)
+        print('Checked {} links in {:.2f}s'.format(len(results), time.perf_counter() - start))
+        check('every link classified as the stand-in answered', results == expected)
+        check('no dead link hidden after one check', not cache.dead_links())
+        check('nothing due straight away', not due(cache))
+
+        _age(cache, 2)
+        check('two days later, only errors and unconfirmed dead links due', due(cache) == unsettled)
+        results = checker.check(urls)
+        check('only those rechecked', set(results) == unsettled)
+        check('dead links confirmed after a second check', cache.dead_links() == dead)
+        trips = hide_dead_links(all_trips(), cache)
+        check('confirmed dead links hidden', not dead.intersection(report_urls(trips)))
+
+        _age(cache, 10)
+        check('ten days later, private and dead links due but not ok ones',
+              not due(cache, OK) and due(cache, PRIVATE) == private and due(cache, DEAD) == dead)
+
+        before = json.dumps(cache.links, sort_keys=True)
+        outage_checker = LinkChecker(cache, _unused_origin(), concurrency, host_interval=0, timeout=5)
+        results = outage_checker.check(urls, force=True)
+        check('an outage is detected and records nothing',
+              outage_checker.outage and not results and json.dumps(cache.links, sort_keys=True) == before)
+
+    server.shutdown()
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check huts/links.py against a local stand-in server.')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--latency', type=float, default=0.01, metavar='SECONDS',
+                        help='how long the stand-in takes to respond')
+    args = parser.parse_args()
+    sys.exit(1 if run(args.concurrency, args.latency) else 0)
@@ -0,0 +1,90 @@
+'''
+Benchmarks huts/mirror.py against a local stand-in for the DOC website, so it
+can be run offline and without load on the real servers.
+
+The stand-in serves a deterministic body for every path (a few KB, like a
+thumbnail), with an ETag and Last-Modified, answers conditional requests with
+304, and waits --latency seconds before each response. The huts' URLs are
+mirrored three times into a temporary cache:
+  - cold: everything is fetched,
+  - warm: everything is fresh, so nothing is requested,
+  - revalidate: everything is stale, so every URL gets a 304.
+
+Usage:
+    PYTHONPATH=. python3 benchmarks/mirror.py [--concurrency 8] [--latency 0.02] [--scale 1]
+'''
+
+import argparse
+from email.utils import formatdate
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import tempfile
+import threading
+import time
+
+from huts.hut import all_huts
+from huts.mirror import Mirror, urls, DEFAULT_CONCURRENCY
+
+BODY_BYTES = 8 * 1024
+LAST_MODIFIED = formatdate(time.time() - 86400, usegmt=True)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+
+    def do_GET(self):
+        seed = hashlib.sha256(self.path.encode('utf-8')).digest()
+        body = (seed * (BODY_BYTES // len(seed) + 1))[:BODY_BYTES]
+        etag = '"{}"'.format(seed.hex()[:16])
+        time.sleep(self.latency)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg' if self.path.endswith('.jpg') else 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(latency):
+    '''Starts the stand-in server in a thread. Returns it; its origin is
+    http://127.0.0.1:<server.server_port>.'''
+    handler = type('Handler', (StandInHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(concurrency, latency, scale):
+    server = serve(latency)
+    origin = 'http://127.0.0.1:{}'.format(server.server_port)
+    hut_urls = urls(all_huts())
+    # extra copies under distinct paths, for bigger runs
+    hut_urls += ['{}?copy={}'.format(u, n) for n in range(1, scale) for u in hut_urls]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name, max_age_hours in [('cold', 24), ('warm', 24), ('revalidate', 0)]:
+            stats = Mirror(cache_dir, origin=origin).mirror(hut_urls, concurrency, max_age_hours)
+            print('{}:'.format(name))
+            stats.report()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark huts/mirror.py against a local stand-in server.')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--latency', type=float, default=0.02, metavar='SECONDS',
+                        help='how long the stand-in takes to respond')
+    parser.add_argument('--scale', type=int, default=1, help='mirror this many copies of each URL')
+    args = parser.parse_args()
+    run(args.concurrency, args.latency, args.scale)
@@ -0,0 +1,220 @@
+'''
+Benchmarks for each stage of the pipeline: loading the hut catalog, enriching
+it with trips, grouping, rendering checklists and maps, and writing files.
+
+Each stage is run against the real data files (scale 1) and against synthetic
+datasets from huts.synth (scale 10 = ten times as many huts and trips as the
+real data, etc). Results are written as JSON so that runs can be compared with
+benchmarks/compare.py.
+
+Usage:
+    PYTHONPATH=. python3 benchmarks/run.py [--scale 1 --scale 10 ...] [--only STAGE ...] [--repeat 3] [--output results.json]
+
+--only runs just the stages whose names start with the given prefix, e.g. the
+attribute filters against ~100k huts (the folium map stages would take
+minutes at that scale):
+    PYTHONPATH=. python3 benchmarks/run.py --scale 106 --only filter --only attribute
+'''
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from huts import leaflet, synth
+from huts.hut import BASE_DIR, DOC_HUTS_FILE, NON_DOC_HUTS_FILE, all_huts
+from huts.merged import (
+    huts_enriched_with_trips,
+    by_all, by_island, by_region, by_place,
+    by_island_by_region, by_region_by_place,
+    by_island_by_region_by_place,
+    filter_known_region_known_place,
+    AttributeIndex,
+)
+from huts.export import filter_huts
+from huts.query import Query
+from huts.columnar import ColumnarCatalog, write_catalog
+from huts.checklist import checklist, write_checklist, HtmlChecklist
+from huts.trips import all_trips, trips_raw
+
+DEFAULT_SCALES = [1, 10]
+DEFAULT_REPEAT = 3
+
+# "unvisited, non-bookable huts with heating in Canterbury"
+ATTRIBUTE_QUERY = dict(facilities=['Heating'], bookable=False, region='Canterbury', visited=False)
+
+
+def timeit(fn, setup=None, repeat=DEFAULT_REPEAT):
+    '''Runs fn(*setup()) repeat times, timing only fn. Returns a list of
+    durations in seconds, and what fn returned the last time.'''
+    durations = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        result = fn(*args)
+        durations.append(time.perf_counter() - start)
+    return durations, result
+
+
+def stages(doc_huts_file, non_doc_huts_file, trips, out_dir):
+    '''Returns a list of (stage name, fn, setup) for every stage of the
+    pipeline. The stages that write files return the number of bytes
+    written.'''
+    load = lambda: all_huts(doc_huts_file, non_doc_huts_file)
+    enriched = filter_known_region_known_place(huts_enriched_with_trips(load(), trips))
+    grouped = by_island_by_region_by_place(enriched)
+
+    def write_checklist_text():
+        filename = os.path.join(out_dir, 'checklist.txt')
+        with open(filename, 'w') as f:
+            write_checklist(grouped, f)
+        return os.path.getsize(filename)
+
+    def write_checklist_html():
+        filename = os.path.join(out_dir, 'checklist.html')
+        with open(filename, 'w') as f:
+            f.write(HtmlChecklist().render_page(grouped))
+        return os.path.getsize(filename)
+
+    def write_native_maps(island_maps):
+        size = 0
+        for i, html in island_maps.items():
+            filename = os.path.join(out_dir, 'native_map.{}.html'.format(i.lower().replace(' ', '_')))
+            with open(filename, 'w') as f:
+                f.write(html)
+            size += os.path.getsize(filename)
+        return size
+
+    columnar_file = os.path.join(out_dir, 'catalog.huts')
+
+    def write_columnar(huts):
+        write_catalog(huts, columnar_file)
+        return os.path.getsize(columnar_file)
+
+    def columnar_written():
+        write_catalog(load(), columnar_file)
+        return ()
+
+    result = [
+        ('load', load, None),
+        ('write_columnar', write_columnar, lambda: (load(),)),
+        # opening the file and reading every hut's name and position
+        ('columnar_open', lambda: [(h.name, h.lat, h.lng) for h in ColumnarCatalog(columnar_file)],
+         columnar_written),
+        ('enrich', lambda huts: huts_enriched_with_trips(huts, trips), lambda: (load(),)),
+        ('by_all', lambda: by_all(enriched), None),
+        ('by_island', lambda: by_island(enriched), None),
+        ('by_region', lambda: by_region(enriched), None),
+        ('by_place', lambda: by_place(enriched), None),
+        ('by_island_by_region', lambda: by_island_by_region(enriched), None),
+        ('by_region_by_place', lambda: by_region_by_place(enriched), None),
+        ('by_island_by_region_by_place', lambda: by_island_by_region_by_place(enriched), None),
+        ('checklist_text', lambda: checklist(grouped), None),
+        ('checklist_html', lambda: HtmlChecklist().render(grouped), None),
+        ('write_checklist_text', write_checklist_text, None),
+        ('write_checklist_html', write_checklist_html, None),
+        ('native_maps', lambda: leaflet.maps(enriched), None),
+        ('write_native_maps', write_native_maps, lambda: (leaflet.maps(enriched),)),
+        ('filter_scan', lambda: list(filter_huts(enriched, **ATTRIBUTE_QUERY)), None),
+        ('attribute_index', lambda: AttributeIndex(enriched), None),
+        ('attribute_select', lambda index: index.select(**ATTRIBUTE_QUERY), lambda: (AttributeIndex(enriched),)),
+        ('query_index', lambda: Query(enriched), None),
+        ('query_select', lambda query: list(query(**ATTRIBUTE_QUERY)), lambda: (Query(enriched),)),
+    ]
+
+    if importlib.util.find_spec('folium') is None:
+        print('folium is not installed, skipping the map stages', file=sys.stderr)
+        return result
+    from huts.map import maps
+
+    def write_maps(island_maps):
+        size = 0
+        for i, m in island_maps.items():
+            filename = os.path.join(out_dir, 'map.{}.html'.format(i.lower().replace(' ', '_')))
+            m.save(filename)
+            size += os.path.getsize(filename)
+        return size
+
+    result.extend([
+        ('maps', lambda: maps(enriched), None),
+        ('write_maps', write_maps, lambda: (maps(enriched),)),
+    ])
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales, repeat, only=None):
+    results = []
+    real_num_huts = len(all_huts())
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in scales:
+            if scale == 1:
+                doc_huts_file, non_doc_huts_file, trips = DOC_HUTS_FILE, NON_DOC_HUTS_FILE, all_trips()
+            else:
+                doc_huts_file, non_doc_huts_file, raw = synth.write_dataset(
+                    os.path.join(tmp_dir, 'x{}'.format(scale)),
+                    scale * real_num_huts, scale * len(trips_raw))
+                trips = all_trips(raw)
+            num_huts = len(all_huts(doc_huts_file, non_doc_huts_file))
+            num_visits = sum(len(t.hut_visits) for t in trips)
+
+            for name, fn, setup in stages(doc_huts_file, non_doc_huts_file, trips, tmp_dir):
+                if only and not any(name.startswith(prefix) for prefix in only):
+                    continue
+                durations, returned = timeit(fn, setup, repeat)
+                result = {
+                    'stage': name,
+                    'scale': scale,
+                    'huts': num_huts,
+                    'visits': num_visits,
+                    'min': min(durations),
+                    'median': statistics.median(durations),
+                    'durations': durations,
+                }
+                size = ''
+                if name.startswith('write_'):
+                    result['bytes'] = returned
+                    size = '{:>12} bytes'.format(returned)
+                print('{:>5}x {:<30} {:>10.4f}s {}'.format(scale, name, result['min'], size))
+                results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the pipeline.')
+    parser.add_argument('--scale', type=int, action='append',
+                        help='dataset scale factor, may be given more than once '
+                             '(defaults to {})'.format(', '.join(map(str, DEFAULT_SCALES))))
+    parser.add_argument('--only', action='append', metavar='STAGE',
+                        help='only run the stages starting with STAGE, may be given more than once')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('-o', '--output',
+                        default=os.path.join(BASE_DIR, 'benchmarks', 'results',
+                                             time.strftime('%Y%m%d-%H%M%S') + '.json'))
+    args = parser.parse_args()
+
+    results = run(args.scale or DEFAULT_SCALES, args.repeat, args.only)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results,
+        }, f, indent=2)
+    print('Writing results to file: {}'.format(args.output))
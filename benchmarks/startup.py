@@ -0,0 +1,160 @@
+'''
+Startup-time regression check for the entry points.
+
+Imports each module in a fresh interpreter with `python -X importtime`, and
+compares the cumulative import time of the module against its budget. Also
+checks that none of them (not even huts.map) pull in folium and its
+dependencies.
+
+Does the same for each subcommand of `python -m huts`: its startup time is
+the import time of huts.__main__ plus the modules the subcommand imports (see
+huts.__main__.COMMANDS).
+
+Finally, runs `python -m huts stats` twice and checks that the second (warm)
+run loads the huts from the columnar catalog, without parsing the DOC
+GeoJSON export (i.e. that importing the modules does no loading of its own).
+
+Usage:
+    PYTHONPATH=. python3 benchmarks/startup.py [--repeat 5]
+
+Exits with status 1 if any module is over budget (best of --repeat runs),
+imports folium, or if the warm run parses the GeoJSON export.
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from huts.hut import BASE_DIR
+
+# Budgets in milliseconds. They're a few times what the imports take on a
+# laptop, so that they only trip on real regressions (e.g. a heavy import
+# creeping back in at module level).
+BUDGETS_MS = {
+    'huts.hut': 10,
+    'huts.trips': 6,
+    'huts.merged': 10,
+    'huts.checklist': 10,
+    'huts.map': 10,
+    'huts.export': 10,
+    'huts.__main__': 15,
+}
+
+# Budgets for the subcommands of `python -m huts`, in milliseconds.
+COMMAND_BUDGETS_MS = {
+    'checklist': 35,
+    'map': 45,
+    'export': 35,
+    'validate': 35,
+    'stats': 35,
+    'build': 45,
+}
+
+# The instrument stage of parsing the DOC export (see huts.hut._doc_huts),
+# which a warm run shouldn't have.
+GEOJSON_STAGE = 'load: parse DOC huts GeoJSON'
+
+# None of the modules should need these at import time.
+MUST_NOT_IMPORT = ['folium', 'jinja2', 'branca', 'requests']
+
+
+def _env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [BASE_DIR, env.get('PYTHONPATH')]))
+    return env
+
+
+def import_time_ms(module):
+    '''Returns the cumulative import time of module, in milliseconds, as
+    reported by -X importtime in a fresh interpreter.'''
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        env=_env(), stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True,
+    ).stderr.decode()
+    for line in output.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1000
+    raise ValueError('no importtime line for {}'.format(module))
+
+
+def command_import_time_ms(command):
+    '''Returns the cumulative import time of huts.__main__ and the modules the
+    subcommand imports, in milliseconds, in a fresh interpreter.'''
+    from huts.__main__ import COMMANDS
+
+    modules = ['huts.__main__'] + COMMANDS[command][2]
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(', '.join(modules))],
+        env=_env(), stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True,
+    ).stderr.decode()
+    total = 0
+    for line in output.splitlines():
+        fields = line.split('|')
+        # only the top-level imports (the others are in their cumulative
+        # times), i.e. huts and its modules, in the order first imported
+        if len(fields) == 3 and fields[2].startswith(' huts'):
+            total += int(fields[1])
+    return total / 1000
+
+
+def imported_modules(module):
+    output = subprocess.run(
+        [sys.executable, '-c', 'import sys, {}; print("\\n".join(sys.modules))'.format(module)],
+        env=_env(), stdout=subprocess.PIPE, check=True,
+    ).stdout.decode()
+    return set(output.split())
+
+
+def command_stages(command):
+    '''Runs `python -m huts <command>` with instrumentation on. Returns the
+    names of the stages it recorded.'''
+    with tempfile.TemporaryDirectory() as tmp:
+        profile = os.path.join(tmp, 'profile.json')
+        env = _env()
+        env['HUTS_PROFILE'] = profile
+        subprocess.run([sys.executable, '-m', 'huts', command], env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        with open(profile) as f:
+            return set(json.load(f)['stages'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check entry point import times.')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    failures = 0
+    for module, budget in BUDGETS_MS.items():
+        best = min(import_time_ms(module) for _ in range(args.repeat))
+        status = 'ok'
+        if best > budget:
+            status = 'OVER BUDGET'
+            failures += 1
+        print('{:<16} {:>8.1f}ms (budget {:>4}ms) {}'.format(module, best, budget, status))
+
+        unwanted = imported_modules(module).intersection(MUST_NOT_IMPORT)
+        if unwanted:
+            print('{:<16} imports {}'.format(module, ', '.join(sorted(unwanted))))
+            failures += 1
+
+    for command, budget in COMMAND_BUDGETS_MS.items():
+        best = min(command_import_time_ms(command) for _ in range(args.repeat))
+        status = 'ok'
+        if best > budget:
+            status = 'OVER BUDGET'
+            failures += 1
+        print('{:<16} {:>8.1f}ms (budget {:>4}ms) {}'.format('huts ' + command, best, budget, status))
+
+    # the first run (re)builds the columnar catalog if the data files changed
+    command_stages('stats')
+    parsed = GEOJSON_STAGE in command_stages('stats')
+    if parsed:
+        failures += 1
+    print('{:<16} {}'.format('warm huts stats', 'parses the GeoJSON export' if parsed else 'ok'))
+
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,223 @@
+'''
+One command line for everything, with a subcommand per task:
+  - checklist, prints the checklist (plaintext, or the HTML page with --html),
+  - map, writes the map pages (and their layers and checklist data),
+  - export, exports the huts (see huts/export.py for the formats and filters),
+  - validate, checks that every trip's hut visits resolve, that the override
+    and alias entries still apply to the DOC export, and reports the trip
+    report links found dead or failing (see huts/links.py),
+  - stats, prints the huts visited (of the total) by island and region, and
+    the trips and nights,
+  - build, writes every website artifact (see huts/build.py), and with
+    --publish DIR publishes them too.
+
+Each invocation loads the catalog once and enriches it with the trips once.
+The catalog is opened from the memory-mapped columnar file (see
+huts.columnar), which is only rebuilt when the data files change, so
+invocations after the first skip federating the sources. --no-cache loads the
+huts from the data files instead. The other caches in .cache/ (the polygon
+lookups, the DOC export snapshot and the link statuses) are shared the same
+way.
+
+Each subcommand only imports the modules it needs (listed in COMMANDS, which
+benchmarks/startup.py uses to check each subcommand's startup time).
+
+Usage:
+    PYTHONPATH=. python3 -m huts [--no-cache] [--profile] COMMAND [options]
+    PYTHONPATH=. python3 -m huts COMMAND --help
+'''
+
+import argparse
+import sys
+
+from huts import instrument
+from huts.export import add_arguments
+
+
+def _load(args):
+    '''The (un-enriched) huts.'''
+    if args.no_cache:
+        from huts.hut import all_huts
+        return all_huts()
+    from huts.columnar import load_catalog
+    return load_catalog().huts()
+
+
+def _trips():
+    from huts.links import hide_dead_links
+    from huts.trips import all_trips
+    return hide_dead_links(all_trips())
+
+
+def _enrichment(args):
+    from huts.merged import Enrichment
+
+    huts = _load(args)
+    trips = _trips()
+    with instrument.stage('enrich'):
+        enrichment = Enrichment(huts)
+        enrichment.sync(trips)
+    return enrichment
+
+
+def checklist(args):
+    from huts.checklist import HtmlChecklist, write_checklist
+    from huts.merged import by_island_by_region_by_place, filter_known_region_known_place
+
+    huts = filter_known_region_known_place(_enrichment(args).huts)
+    if args.html:
+        sys.stdout.write(HtmlChecklist().render_page(by_island_by_region_by_place(huts)))
+    else:
+        write_checklist(by_island_by_region_by_place(huts), sys.stdout)
+
+
+def _builder(args, checklist_page):
+    from huts.build import Builder
+
+    return Builder(native=args.native, checklist_page=checklist_page, thumbnails=args.thumbnails,
+                   load=lambda: _load(args))
+
+
+def map_(args):
+    _builder(args, checklist_page=False).build()
+
+
+def export(args):
+    from huts import export
+
+    export.run(args.parser, args, _enrichment(args).huts)
+
+
+def validate(args):
+    from huts.hut import Catalog
+    from huts.importer import load_snapshot, stale_aliases, stale_overrides
+    from huts.links import DEAD, ERROR, LinkCache, report_urls
+    from huts.trips import all_trips
+
+    huts = _load(args)
+    trips = all_trips()
+    catalog = Catalog(huts)
+    problems = []
+    for t in trips:
+        for hv in t.hut_visits:
+            try:
+                catalog.resolve_visit(hv)
+            except ValueError as e:
+                problems.append(u'{} ({}): {}'.format(t.desc, hv.arrival, e))
+    snapshot = load_snapshot()
+    problems += stale_overrides(snapshot)
+    problems += stale_aliases(snapshot, set(h.id for h in huts))
+
+    print('{} huts, {} trips, {} hut visits'.format(
+        len(huts), len(trips), sum(len(t.hut_visits) for t in trips)))
+    if problems:
+        print('Problems ({}):'.format(len(problems)))
+        for p in problems:
+            print(u'    {}'.format(p))
+    else:
+        print('No problems.')
+
+    cache = LinkCache()
+    urls = report_urls(trips)
+    failing = [url for url in urls if cache.status(url) in (DEAD, ERROR)]
+    unchecked = sum(1 for url in urls if cache.is_due(url))
+    print('Trip report links: {} ({} due to be checked with huts/links.py)'.format(len(urls), unchecked))
+    for url in failing:
+        entry = cache.links[url]
+        print(u'    {}: {} ({})'.format(entry['status'], url, entry['message'] or entry['code']))
+    return 1 if problems else 0
+
+
+def stats(args):
+    from huts.hut import island_order, region_rank
+
+    enrichment = _enrichment(args)
+    regions = {}
+    for h in enrichment.huts:
+        regions.setdefault(h.island, set()).add(h.region)
+
+    def line(indent, label, *category):
+        visited = enrichment.visited_count(*category)
+        total = enrichment.total_count(*category)
+        print(u'{}{:<{}} {:>5} / {:<5} {:>5.1f}%'.format(
+            ' ' * indent, label, 40 - indent, visited, total, 100.0 * visited / total if total else 0))
+
+    line(0, 'All huts')
+    for i in island_order:
+        if i not in regions:
+            continue
+        line(2, i, i)
+        for r in sorted(regions[i], key=lambda r: (region_rank.get(r, len(region_rank)), r or '')):
+            line(4, r or 'Unknown region', i, r)
+
+    trips = enrichment.trips
+    print('Trips: {} ({} aborted)'.format(len(trips), sum(1 for t in trips if t.aborted)))
+    print('Nights in huts: {}'.format(sum(hv.num_days for t in trips for hv in t.hut_visits if hv.sleep)))
+
+
+def build(args):
+    from huts.build import watch
+
+    builder = _builder(args, checklist_page=True)
+    builder.build()
+    if args.publish:
+        from huts.publish import publish
+        publish(args.publish)
+    if args.watch:
+        instrument.finish()
+        try:
+            watch(builder)
+        except KeyboardInterrupt:
+            pass
+
+
+# name: (function, help, the modules it imports)
+COMMANDS = {
+    'checklist': (checklist, 'print the checklist',
+                  ['huts.columnar', 'huts.links', 'huts.merged', 'huts.checklist']),
+    'map': (map_, 'write the map pages', ['huts.columnar', 'huts.build']),
+    'export': (export, 'export the huts as GeoJSON, JSON Lines or tiles',
+               ['huts.columnar', 'huts.links', 'huts.merged', 'huts.export']),
+    'validate': (validate, 'check the trips, overrides, aliases and links',
+                 ['huts.columnar', 'huts.importer', 'huts.links', 'huts.trips']),
+    'stats': (stats, 'print visited counts by island and region',
+              ['huts.columnar', 'huts.links', 'huts.merged']),
+    'build': (build, 'write (and optionally publish) every website artifact',
+              ['huts.columnar', 'huts.build']),
+}
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog='python -m huts', description='Track and render the huts visited.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='load the huts from the data files rather than the columnar catalog')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND', required=True)
+    commands = {}
+    for name, (_, help_, _) in COMMANDS.items():
+        commands[name] = subparsers.add_parser(name, help=help_, description=help_[0].upper() + help_[1:] + '.')
+
+    commands['checklist'].add_argument('--html', action='store_true', help='print the HTML page')
+    for name in ['map', 'build']:
+        commands[name].add_argument('--native', action='store_true',
+                                    help='write the map pages directly rather than through folium')
+        commands[name].add_argument('--thumbnails', action='store_true',
+                                    help='embed the mirrored thumbnails in the map popups')
+    commands['build'].add_argument('--publish', metavar='DEST_DIR', help='then publish to DEST_DIR')
+    commands['build'].add_argument('--watch', action='store_true',
+                                   help='keep rebuilding when the trips or data files change')
+    add_arguments(commands['export'])
+    commands['export'].set_defaults(parser=commands['export'])
+    return parser
+
+
+def main(argv=sys.argv):
+    instrument.configure(argv)
+    args = _parser().parse_args(argv[1:])
+    function = COMMANDS[args.command][0]
+    status = function(args)
+    instrument.finish()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
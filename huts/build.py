@@ -0,0 +1,238 @@
+'''
+Builds the website artifacts in one go, from one catalog load and one
+enrichment pass:
+  - rendered_checklist.html, the checklist page,
+  - rendered_map.<island>.html, the map page for each island,
+  - hut_layer.<region>.<hash>.json, the "Not visited" layer of each region,
+    which the map pages load on demand (see huts.map.layer_shards),
+  - checklist_data.<island>.js, the per-region checklists for each map page,
+  - with --thumbnails, thumbs/<hash>.<ext>, local copies of the huts'
+    thumbnails (those mirrored by huts/mirror.py), which the map popups embed.
+
+Outputs whose content hasn't changed aren't rewritten (see huts.output), and
+the content hashes of all outputs are recorded in rendered_manifest.json.
+
+Trip report links that huts/links.py found dead are left out.
+
+With --watch, keeps running after the first build, with the catalog and
+renderers kept warm in memory. It polls huts/trips.py, the data files and the
+link statuses, and on a change reloads just what changed (the trips, or the
+catalog) and rebuilds. Only the outputs that changed are re-rendered and rewritten.
+
+Usage:
+    PYTHONPATH=. python3 huts/build.py [--native] [--thumbnails] [--watch] [--profile]
+'''
+
+from glob import glob
+import importlib
+import json
+import os
+import sys
+import time
+import traceback
+
+from huts import instrument
+from huts import trips as trips_module
+from huts.links import LINK_STATUS_FILE, hide_dead_links
+from huts.output import OutputDir
+from huts.hut import BASE_DIR, island_order, all_huts
+from huts.merged import (
+    Enrichment,
+    filter_known_region_known_place,
+    by_island_by_region_by_place, by_region_by_place,
+)
+from huts.checklist import header, HtmlChecklist
+
+CHECKLIST_FILENAME = 'rendered_checklist.html'
+MAP_FILENAME = 'rendered_map.{}.html'
+CHECKLIST_DATA_FILENAME = 'checklist_data.{}.js'
+THUMBNAILS_DIRNAME = 'thumbs'
+
+TRIPS_FILE = trips_module.__file__
+DATA_FILES = os.path.join(BASE_DIR, 'data', '*.*json')
+
+POLL_INTERVAL = 0.25
+
+
+def _island_filename(island):
+    return island.lower().replace(' ', '_')
+
+
+class Builder(object):
+    '''Holds everything that can be kept between builds: the catalog (loaded
+    once, and kept enriched as trips are added, removed and changed), the
+    checklist fragment cache,
+    a signature of what each map depicts, and the hashes of the outputs.
+    load returns the (un-enriched) huts, e.g. huts.columnar.load_catalog's
+    views instead of all_huts().'''
+
+    def __init__(self, out_dir=BASE_DIR, native=False, checklist_page=True, thumbnails=False, load=all_huts):
+        self.out_dir = out_dir
+        self.load = load
+        self.outputs = OutputDir(out_dir)
+        self.native = native
+        self.thumbnails = thumbnails
+        self.checklist_page = checklist_page
+        self.checklist_renderer = HtmlChecklist()
+        self._map_signatures = {}
+        self.trips = hide_dead_links(trips_module.all_trips())
+        self.reload_catalog()
+
+    def reload_catalog(self):
+        with instrument.stage('build: load catalog'):
+            self.catalog = self.load()
+        with instrument.stage('enrich'):
+            self.enrichment = Enrichment(self.catalog)
+            self.enrichment.sync(self.trips)
+
+    def reload_trips(self):
+        '''Reloads trips.py (and the dead links), and re-tags only the huts on
+        the trips that were added, removed or changed.'''
+        with instrument.stage('build: load trips'):
+            importlib.reload(trips_module)
+            self.trips = hide_dead_links(trips_module.all_trips())
+        with instrument.stage('enrich'):
+            added, removed = self.enrichment.sync(self.trips)
+        print('Trips: {} added, {} removed'.format(added, removed))
+
+    def enrich(self):
+        return filter_known_region_known_place(self.catalog)
+
+    def build(self):
+        '''Renders and writes all outputs. Returns the filenames written.'''
+        huts = self.enrich()
+        written = []
+
+        if self.checklist_page:
+            page = self.checklist_renderer.render_page(by_island_by_region_by_place(huts))
+            written += self._write(CHECKLIST_FILENAME, page)
+
+        if self.thumbnails:
+            written += self._write_thumbnails(huts)
+
+        from huts.map import LAYER_FILE_PATTERN, layer_shards
+        shards = layer_shards(huts)
+        for filename, content in shards.values():
+            written += self._write(filename, content)
+        keep = [filename for filename, _ in shards.values()]
+        for filename in self.outputs.prune(LAYER_FILE_PATTERN, keep):
+            print('Removed file: {}'.format(self.outputs.path(filename)))
+        layer_urls = {name: filename for name, (filename, _) in shards.items()}
+
+        for i, html in self._render_maps(huts, layer_urls).items():
+            written += self._write(MAP_FILENAME.format(_island_filename(i)), html)
+
+        huts_by_region = by_region_by_place(huts)
+        checklist_data = {"header": header(html=True)}
+        for r, huts_by_place in huts_by_region.items():
+            checklist_data[r] = self.checklist_renderer.render({r: huts_by_place})
+        checklist_data_js = 'var checklist_data = {};'.format(
+            json.dumps(checklist_data, separators=(',', ':')))
+        for i in island_order:
+            written += self._write(CHECKLIST_DATA_FILENAME.format(_island_filename(i)), checklist_data_js)
+
+        self.outputs.write_manifest()
+        return written
+
+    def _write_thumbnails(self, huts):
+        '''Points the huts' popups at local copies of their mirrored
+        thumbnails, and writes the copies. They're named by content hash, so
+        existing ones are left alone.'''
+        from huts.mirror import Mirror, attach_thumbnails
+
+        mirror = Mirror()
+        os.makedirs(self.outputs.path(THUMBNAILS_DIRNAME), exist_ok=True)
+        written = []
+        for name, url in attach_thumbnails(huts, mirror, THUMBNAILS_DIRNAME + '/').items():
+            filename = '{}/{}'.format(THUMBNAILS_DIRNAME, name)
+            if not os.path.exists(self.outputs.path(filename)):
+                written += self._write(filename, mirror.read(url))
+        return written
+
+    def _render_maps(self, huts, layer_urls):
+        '''Returns {island: html} for the islands whose huts changed (in any
+        way visible on the map) since the last build.'''
+        from huts.map import popup_html
+
+        signatures = {i: [] for i in island_order}
+        for h in huts:
+            signatures[h.island].append((h.lat, h.lng, h.region, h.visited, popup_html(h)))
+        changed = [i for i in island_order if signatures[i] != self._map_signatures.get(i)]
+        if not changed:
+            return {}
+
+        if self.native:
+            from huts import leaflet
+            island_maps = leaflet.maps(huts, layer_urls)
+        else:
+            from huts.map import maps
+            island_maps = {i: m.get_root().render() for i, m in maps(huts, layer_urls).items()}
+
+        for i in changed:
+            self._map_signatures[i] = signatures[i]
+        return {i: island_maps[i] for i in changed}
+
+    def _write(self, filename, content):
+        '''Writes content to out_dir/filename, unless it's already there.
+        Returns a list of the filenames written (0 or 1).'''
+        if not self.outputs.write(filename, content):
+            return []
+        path = self.outputs.path(filename)
+        print('Wrote file: {}'.format(path))
+        return [path]
+
+
+def _mtimes():
+    result = {}
+    for path in [TRIPS_FILE, LINK_STATUS_FILE] + glob(DATA_FILES):
+        try:
+            result[path] = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return result
+
+
+def watch(builder, interval=POLL_INTERVAL):
+    '''Rebuilds whenever the trips or data files change. Runs until
+    interrupted.'''
+    mtimes = _mtimes()
+    print('Watching {}, {} and {} for changes...'.format(TRIPS_FILE, DATA_FILES, LINK_STATUS_FILE))
+    while True:
+        time.sleep(interval)
+        new_mtimes = _mtimes()
+        changed = set(mtimes).symmetric_difference(new_mtimes)
+        changed.update(p for p in new_mtimes if new_mtimes[p] != mtimes.get(p))
+        if not changed:
+            continue
+        mtimes = new_mtimes
+
+        start = time.perf_counter()
+        try:
+            trips_files = {TRIPS_FILE, LINK_STATUS_FILE}
+            if changed - trips_files:
+                builder.reload_catalog()
+            if changed & trips_files:
+                builder.reload_trips()
+            written = builder.build()
+        except Exception:
+            # e.g. a typo in trips.py; keep watching so it can be fixed
+            traceback.print_exc()
+            continue
+        print('Rebuilt ({} files written) in {:.3f}s'.format(len(written), time.perf_counter() - start))
+
+
+def main(argv=sys.argv, checklist_page=True):
+    instrument.configure(argv)
+    builder = Builder(native='--native' in argv[1:], checklist_page=checklist_page,
+                      thumbnails='--thumbnails' in argv[1:])
+    builder.build()
+    instrument.finish()
+    if '--watch' in argv[1:]:
+        try:
+            watch(builder)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,13 @@
 Utility for creating checklists of which huts have/haven't been visited.
 '''
 from collections import defaultdict
+from operator import attrgetter
+from string import Template
 
-from huts.hut import island_order, region_order, place_order
+from huts import instrument
+from huts.hut import island_rank, region_rank, place_rank
+
+_by_name = attrgetter('name')
 
 
 def newline(html):
@@ -20,10 +25,11 @@ def header(html):
 
 
 def _intersperse(iterable, delimiter):
-    it = iter(iterable)
-    yield next(it)
-    for x in it:
-        yield delimiter
+    first = True
+    for x in iterable:
+        if not first:
+            yield delimiter
+        first = False
         yield x
 
 
@@ -50,13 +56,29 @@ def checklist(huts_by_category, sort_fn=None, html=False):
     Hut name will be an anchor pointing to the hut's url.
     Links to trip reports will be added to the date strings.
     ''' 
+    return list(iter_checklist(huts_by_category, sort_fn, html))
+
+
+def iter_checklist(huts_by_category, sort_fn=None, html=False):
+    '''Like checklist(), but lazily yields the items one at a time, in order,
+    instead of building the whole list.'''
     result = checklist_recursive(huts_by_category, '', sort_fn, html)
     if html:
-        return list(_intersperse(result, newline(html)))
+        return _intersperse(result, newline(html))
     else:
         return result
 
 
+def write_checklist(huts_by_category, f, sort_fn=None, html=False):
+    '''Streams the checklist to the file-like object f (e.g. sys.stdout, an
+    open file, or socket.makefile('w')), one item per line, as it is rendered.'''
+    with instrument.stage('checklist: render and write'):
+        for item in iter_checklist(huts_by_category, sort_fn, html):
+            f.write(item)
+            f.write('\n')
+            instrument.count('checklist items', 1)
+
+
 def count_visits_recursive(huts_by_category):
     '''Given a dict, keys are categories, values are possibly nested categories.
     Returns another dict with the same keys, where the values are tuples of
@@ -81,28 +103,46 @@ def count_visits_recursive(huts_by_category):
     return result
 
 
+def _ordered_categories(huts_by_category):
+    '''Returns the keys of huts_by_category in their fixed sort order.'''
+    if len(huts_by_category) == 1: # special for "by_all"
+        return list(huts_by_category)
+
+    for rank in (island_rank, region_rank, place_rank):
+        if any(c in rank for c in huts_by_category):
+            # the rank is a total order; but we are only visiting a subset
+            return sorted(filter(rank.__contains__, huts_by_category), key=rank.__getitem__)
+
+    raise ValueError('unknown category: {}'.format(next(iter(huts_by_category))))
+
+
+def _hut_item(h, html):
+    '''Renders a single hut: checkbox, name and (if visited) dates.'''
+    checkbox_string = ''
+    if h.visited:
+        checkbox_string = '\u2611'  if html else '[X]'
+    else:
+        checkbox_string = '\u2610' if html else '[ ]'
+    name_string = h.render_name(html=html)
+    if not h.doc_maintained:
+        name_string += ' (not DOC maintained)'
+    visit_string = ''
+    if h.visited:
+        visit_string = ' ({})'.format(h.render_dates_visited(html=html))
+    if h.visited and not h.sleep:
+        visit_string += ' (did not sleep in hut)'
+    return u'{} {}{}'.format(checkbox_string, name_string, visit_string)
+
+
 def checklist_recursive(huts_by_category, indent, sort_fn, html):
+    '''Generator yielding the checklist items for huts_by_category (and,
+    recursively, its subcategories) in order.'''
     if html:
         indent_char = '&nbsp;'
     else:
         indent_char = ' '
     INDENT_INCREMENT = 8 * indent_char
 
-    result = []
-
-    # determine category order
-    categories = set(huts_by_category.keys())
-    if len(categories) == 1: # special for "by_all"
-        category_order = categories
-    elif categories.intersection(set(island_order)):
-        category_order = island_order
-    elif categories.intersection(set(region_order)):
-        category_order = region_order
-    elif categories.intersection(set(place_order)):
-        category_order = place_order
-    else:
-        raise ValueError('unknown category: {}'.format(categories[0]))
-
     # determine if need to recur
     vals = list(huts_by_category.values())
     should_recur = (type(vals[0]) == type(defaultdict(list)))
@@ -110,67 +150,36 @@ def checklist_recursive(huts_by_category, indent, sort_fn, html):
     # prep the category counts
     category_counts = count_visits_recursive(huts_by_category)
 
-    # the category_order is a total order; but we are only visiting a subset
-    categories_to_visit = filter(lambda x: x in categories, category_order)
-    for c in categories_to_visit:
+    for c in _ordered_categories(huts_by_category):
         # print the category header
         visited_in_category = category_counts[c][0]
         total_in_category = category_counts[c][1]
         if total_in_category == 0:
             # can occur if we're excluding closed huts
             continue
-        result.append(u'{}{} ({} of {}):'.format(indent, c.upper(), visited_in_category, total_in_category))
+        yield u'{}{} ({} of {}):'.format(indent, c.upper(), visited_in_category, total_in_category)
 
         # base case: we're at hut level so we just print the huts
         if not should_recur:
             if not sort_fn:
-                sort_fn = lambda h: h.name
+                sort_fn = _by_name
 
             huts = sorted(huts_by_category[c], key=sort_fn)
             for h in huts:
-                checkbox_string = ''
-                if h.visited:
-                    checkbox_string = '\u2611'  if html else '[X]'
-                else:
-                    checkbox_string = '\u2610' if html else '[ ]'
-                name_string = h.render_name(html=html)
-                if not h.doc_maintained:
-                    name_string += ' (not DOC maintained)'
-                visit_string = ''
-                if h.visited:
-                    visit_string = ' ({})'.format(h.render_dates_visited(html=html))
-                if h.visited and not h.sleep:
-                    visit_string += ' (did not sleep in hut)'
-                result.append(u'{}{} {}{}'.format(indent + INDENT_INCREMENT, checkbox_string, name_string, visit_string))
+                yield u'{}{}'.format(indent + INDENT_INCREMENT, _hut_item(h, html))
 
         # recursive step: recur on the subcategories, increasing the indent
         else:
-            sublist = checklist_recursive(huts_by_category[c], indent + INDENT_INCREMENT, sort_fn, html)
-            result.extend(sublist)
+            yield from checklist_recursive(huts_by_category[c], indent + INDENT_INCREMENT, sort_fn, html)
 
     # shitty hack, print a grand total for the top-level
     if not indent:
         visited = sum([v[0] for v in category_counts.values()])
         total = sum([v[1] for v in category_counts.values()])
-        result.append('TOTAL {} of {} visited'.format(visited, total))
-
-    return result
+        yield 'TOTAL {} of {} visited'.format(visited, total)
 
-if __name__ == '__main__':
-    import sys
-    from huts.merged import (
-            huts_enriched_with_trips,
-            by_all, by_island, by_region, by_place,
-            by_island_by_region, by_region_by_place,
-            by_island_by_region_by_place,
-            filter_known_region_known_place,
-    )
-    huts = filter_known_region_known_place(huts_enriched_with_trips())
-
-    html = len(sys.argv) > 1 and sys.argv[1] == 'html'
-    if html:
-        print('''
-<!doctype html>
+# Templates for HtmlChecklist, compiled once at import time.
+PAGE_TEMPLATE = Template('''<!doctype html>
 <html>
     <head>
         <script async src="https://www.googletagmanager.com/gtag/js?id=UA-139615802-1"></script>
@@ -183,15 +192,112 @@ if __name__ == '__main__':
         <meta charset="utf-8"/>
         <title>Hut checklist</title>
         <link rel="stylesheet" href="/assets/css/styles.css">
+        <style>ul.checklist, ul.checklist ul {list-style: none; padding-left: 2em;}</style>
     </head>
     <body>
-        ''')
-        print(header(html))
-        print(2 * newline(html))
-    for item in checklist(by_island_by_region_by_place(huts), html=html):
-        print(item)
-    if html:
-        print('''
+        <p>$header</p>
+$checklist
     </body>
 </html>
-        ''')
+''')
+CHECKLIST_TEMPLATE = Template('''<ul class="checklist">
+$categories</ul>
+<p>TOTAL $visited of $total visited</p>''')
+CATEGORY_TEMPLATE = Template('''<li>$name ($visited of $total):<ul>
+$items</ul></li>
+''')
+HUT_TEMPLATE = Template('''<li>$item</li>
+''')
+
+
+def _hut_state(h):
+    '''Everything about a hut that affects how it is rendered.'''
+    return (h.name, h.url, h.doc_maintained, h.visited, h.sleep,
+            tuple((t.start, t.desc, t.reports, hv.arrival, hv.num_days) for t, hv in h.visits()))
+
+
+class HtmlChecklist(object):
+    '''Renders checklists as nested HTML lists (rather than <br/>-separated
+    lines indented with &nbsp;).
+
+    The rendered fragment for each category (island/region/place) is cached,
+    keyed on the state of the huts in that category. Re-rendering after a new
+    trip therefore only redoes the categories containing the huts that
+    changed. Only the latest fragment per category is kept, so the cache
+    doesn't grow across re-renders.
+    '''
+
+    def __init__(self, sort_fn=None):
+        self.sort_fn = sort_fn or _by_name
+        self._fragments = {}
+
+    def render(self, huts_by_category):
+        '''Same input as checklist(). Returns the checklist as a string.'''
+        with instrument.stage('checklist: render html'):
+            _, categories, visited, total = self._render_categories(huts_by_category, ())
+        return CHECKLIST_TEMPLATE.substitute(categories=categories, visited=visited, total=total)
+
+    def render_page(self, huts_by_category):
+        '''Returns a complete HTML document: header and checklist.'''
+        return PAGE_TEMPLATE.substitute(header=header(html=True), checklist=self.render(huts_by_category))
+
+    def _render_categories(self, huts_by_category, path):
+        '''Returns (state, fragment, visited, total) for the categories in
+        huts_by_category, in order.'''
+        states = []
+        fragments = []
+        visited = 0
+        total = 0
+        for c in _ordered_categories(huts_by_category):
+            state, fragment, c_visited, c_total = self._render_category(
+                huts_by_category[c], path + (c,))
+            if c_total == 0:
+                # can occur if we're excluding closed huts
+                continue
+            states.append(state)
+            fragments.append(fragment)
+            visited += c_visited
+            total += c_total
+        return tuple(states), ''.join(fragments), visited, total
+
+    def _render_category(self, huts_or_subcategories, path):
+        if isinstance(huts_or_subcategories, dict):
+            state, items, visited, total = self._render_categories(huts_or_subcategories, path)
+            cached = self._fragments.get(path)
+            if cached and cached[0] == state:
+                return cached
+        else:
+            huts = sorted(huts_or_subcategories, key=self.sort_fn)
+            state = tuple(map(_hut_state, huts))
+            cached = self._fragments.get(path)
+            if cached and cached[0] == state:
+                return cached
+            items = ''.join(HUT_TEMPLATE.substitute(item=_hut_item(h, html=True)) for h in huts)
+            visited = sum(1 for h in huts if h.visited)
+            total = len(huts)
+
+        fragment = CATEGORY_TEMPLATE.substitute(
+            name=path[-1].upper(), visited=visited, total=total, items=items)
+        result = (state, fragment, visited, total)
+        self._fragments[path] = result
+        return result
+
+
+if __name__ == '__main__':
+    import sys
+    instrument.configure(sys.argv)
+    from huts.merged import (
+            huts_enriched_with_trips,
+            by_all, by_island, by_region, by_place,
+            by_island_by_region, by_region_by_place,
+            by_island_by_region_by_place,
+            filter_known_region_known_place,
+    )
+    huts = filter_known_region_known_place(huts_enriched_with_trips())
+
+    html = len(sys.argv) > 1 and sys.argv[1] == 'html'
+    if html:
+        sys.stdout.write(HtmlChecklist().render_page(by_island_by_region_by_place(huts)))
+    else:
+        write_checklist(by_island_by_region_by_place(huts), sys.stdout)
+    instrument.finish()
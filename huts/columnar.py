@@ -0,0 +1,323 @@
+'''
+The normalized hut catalog (all_huts(), with the overrides and polygon lookups
+applied) as a memory-mapped columnar file, so that worker processes and the
+notebook can open it without parsing DOC_Huts.geojson or unpickling Huts, and
+share its pages through the page cache.
+
+The file (.cache/catalog.huts by default) is laid out as:
+  - MAGIC, then the length of the header (8 bytes, little-endian),
+  - the header, as JSON: the number of huts, the hash of the data files the
+    catalog was built from, the distinct islands/regions/places, the facility
+    names (in the order of their bits), and the offset, size and format (a
+    struct/array code) of each column,
+  - the columns, each 8-byte aligned:
+      id (q), lat, lng (d), island, region, place (i, indexes into the
+      header's lists), facilities (Q, the bitmask over the header's facility
+      names, see huts.hut.facility_mask; as facility_words 64-bit words per
+      hut, least significant first, when there are more than 64 names), flags
+      (B, doc_maintained and bookable),
+      and for each of name, url, thumbnail, global_id and provenance (as
+      JSON, see huts.sources), n + 1 offsets (Q) into a blob of UTF-8 (an
+      empty string is read back as None, except for name).
+
+ColumnarCatalog maps the file and exposes each column as a memoryview (or,
+with column(), a numpy array over the same memory). Its HutViews are Huts
+that read their fields from the columns as they're accessed, so they can be
+enriched with trips, grouped and rendered like any other Huts. Pickling a
+HutView sends just the path of the file and the hut's position (plus any
+trip data it has been tagged with); the receiving process maps the file
+itself.
+
+load_catalog() rebuilds the file when the data files have changed.
+'''
+
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+
+from huts import instrument
+from huts.hut import (
+    BASE_DIR, DOC_HUTS_FILE, NON_DOC_HUTS_FILE, OVERRIDE_PLACE_FILE, OVERRIDE_REGION_FILE,
+    Hut, all_huts, island_rank, region_rank, place_codes, _merge_places,
+    facility_order, facility_bit, facility_mask,
+)
+from huts.output import atomic_write, content_hash, file_hash
+
+CATALOG_FILE = os.path.join(BASE_DIR, '.cache', 'catalog.huts')
+
+MAGIC = b'HUTCOL3\n'
+HEADER_LENGTH = struct.Struct('<Q')
+ALIGNMENT = 8
+
+NUMERIC_COLUMNS = [
+    ('id', 'q'), ('lat', 'd'), ('lng', 'd'),
+    ('island', 'i'), ('region', 'i'), ('place', 'i'),
+    ('facilities', 'Q'), ('flags', 'B'),
+]
+CATEGORY_COLUMNS = ['island', 'region', 'place']
+STRING_COLUMNS = ['name', 'url', 'thumbnail', 'global_id', 'provenance']
+# stored as JSON
+JSON_COLUMNS = {'provenance'}
+# read back as None when empty
+OPTIONAL_STRING_COLUMNS = {'url', 'thumbnail', 'global_id'}
+
+FLAG_DOC_MAINTAINED = 1
+FLAG_BOOKABLE = 2
+
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+
+def _source_files():
+    from huts import geo, sources
+    return [DOC_HUTS_FILE, NON_DOC_HUTS_FILE, OVERRIDE_PLACE_FILE, OVERRIDE_REGION_FILE,
+            geo.ISLANDS_FILE, geo.REGIONS_FILE, sources.SOURCES_FILE] + [
+            source.path for source in sources.extra_sources()]
+
+
+def source_hash():
+    '''A hash of the data files the catalog is built from.'''
+    return content_hash(json.dumps([file_hash(path) for path in _source_files()]))
+
+
+def write_catalog(huts, path=CATALOG_FILE, source_sha256=None):
+    '''Writes huts to path in the columnar format.'''
+    # (huts from other sources may have no region)
+    categories = {c: sorted(set(getattr(h, c) for h in huts), key=lambda v: (v is None, v or ''))
+                  for c in CATEGORY_COLUMNS}
+    category_index = {c: {v: i for i, v in enumerate(values)} for c, values in categories.items()}
+    # the vocabulary grows as sources are loaded, so the bits are only
+    # meaningful together with the names
+    facilities = list(facility_order)
+    facility_words = max(1, -(-len(facilities) // WORD_BITS))
+
+    values = {
+        'id': [h.id for h in huts],
+        'lat': [h.lat for h in huts],
+        'lng': [h.lng for h in huts],
+        'facilities': [(h.facilities >> (WORD_BITS * k)) & WORD_MASK
+                       for h in huts for k in range(facility_words)],
+        'flags': [(FLAG_DOC_MAINTAINED if h.doc_maintained else 0) | (FLAG_BOOKABLE if h.bookable else 0)
+                  for h in huts],
+    }
+    for c in CATEGORY_COLUMNS:
+        values[c] = [category_index[c][getattr(h, c)] for h in huts]
+
+    sections = []  # (column, format, bytes)
+    for column, fmt in NUMERIC_COLUMNS:
+        sections.append((column, fmt, array.array(fmt, values[column]).tobytes()))
+    for column in STRING_COLUMNS:
+        if column in JSON_COLUMNS:
+            encoded = [json.dumps(getattr(h, column), ensure_ascii=False).encode('utf-8') for h in huts]
+        else:
+            encoded = [(getattr(h, column) or '').encode('utf-8') for h in huts]
+        offsets = [0]
+        for e in encoded:
+            offsets.append(offsets[-1] + len(e))
+        sections.append((column + '.offsets', 'Q', array.array('Q', offsets).tobytes()))
+        sections.append((column + '.blob', 'B', b''.join(encoded)))
+
+    def aligned(n):
+        return -(-n // ALIGNMENT) * ALIGNMENT
+
+    columns = {}
+    offset = 0
+    for column, fmt, data in sections:
+        columns[column] = {'format': fmt, 'offset': offset, 'size': len(data)}
+        offset = aligned(offset + len(data))
+    header = json.dumps({
+        'count': len(huts),
+        'byteorder': sys.byteorder,
+        'source_sha256': source_sha256,
+        'categories': categories,
+        'facilities': facilities,
+        'facility_words': facility_words,
+        'columns': columns,
+    }, ensure_ascii=False).encode('utf-8')
+    header += b' ' * (aligned(len(header)) - len(header))
+
+    parts = [MAGIC, HEADER_LENGTH.pack(len(header)), header]
+    for column, _, data in sections:
+        parts.append(data + b'\0' * (aligned(len(data)) - len(data)))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    atomic_write(path, b''.join(parts))
+
+
+class ColumnarCatalog(object):
+    '''A memory-mapped columnar catalog file (see the module docstring).'''
+
+    def __init__(self, path=CATALOG_FILE):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError('not a columnar catalog: {}'.format(path))
+        header_length, = HEADER_LENGTH.unpack_from(self._mm, len(MAGIC))
+        data_start = len(MAGIC) + HEADER_LENGTH.size
+        self.header = json.loads(self._mm[data_start:data_start + header_length].decode('utf-8'))
+        if self.header['byteorder'] != sys.byteorder:
+            raise ValueError('columnar catalog written with a different byte order: {}'.format(path))
+        self._data_start = data_start + header_length
+
+        self.count = self.header['count']
+        self.categories = self.header['categories']
+        buf = memoryview(self._mm)
+        self.columns = {}
+        for column, c in self.header['columns'].items():
+            start = self._data_start + c['offset']
+            self.columns[column] = buf[start:start + c['size']].cast(c['format'])
+        # views of the huts, made on first access
+        self._views = [None] * self.count
+
+        _merge_places(self.categories['place'])
+        self._facility_words = self.header['facility_words']
+        # this process may have given some of the facility names other bits
+        # (or not know them yet); if so, facilities are translated
+        facility_names = self.header['facilities']
+        facility_mask(facility_names)
+        self._facility_bits = None
+        if any(facility_bit[f] != 1 << i for i, f in enumerate(facility_names)):
+            self._facility_bits = [facility_bit[f] for f in facility_names]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        view = self._views[i]
+        if view is None:
+            view = self._views[i] = HutView(self, i)
+        return view
+
+    def __iter__(self):
+        return (self[i] for i in range(self.count))
+
+    def huts(self):
+        '''All the huts, as a list of HutViews.'''
+        return list(self)
+
+    def column(self, column):
+        '''A numpy array over the column's memory (no copy).'''
+        import numpy as np
+
+        c = self.header['columns'][column]
+        count = c['size'] // struct.calcsize(c['format'])
+        return np.frombuffer(self._mm, dtype=np.dtype(c['format']), count=count,
+                             offset=self._data_start + c['offset'])
+
+    def facilities(self, i):
+        '''The facilities bitmask of the i'th hut, in this process's bits.'''
+        words = self._facility_words
+        column = self.columns['facilities']
+        if words == 1:
+            mask = column[i]
+        else:
+            mask = 0
+            for k in range(words):
+                mask |= column[i * words + k] << (WORD_BITS * k)
+        if self._facility_bits is None:
+            return mask
+        result = 0
+        for n, bit in enumerate(self._facility_bits):
+            if mask >> n & 1:
+                result |= bit
+        return result
+
+    def string(self, column, i):
+        offsets = self.columns[column + '.offsets']
+        s = bytes(self.columns[column + '.blob'][offsets[i]:offsets[i + 1]]).decode('utf-8')
+        if not s and column in OPTIONAL_STRING_COLUMNS:
+            return None
+        return s
+
+
+_catalogs = {}
+
+
+def open_catalog(path=CATALOG_FILE):
+    '''The ColumnarCatalog for path, opened once per process.'''
+    catalog = _catalogs.get(path)
+    if catalog is None:
+        catalog = _catalogs[path] = ColumnarCatalog(path)
+    return catalog
+
+
+def _hut_view(path, i):
+    return open_catalog(path)[i]
+
+
+def _category(column):
+    def get(view):
+        catalog = view._catalog
+        return catalog.categories[column][catalog.columns[column][view._i]]
+    return get
+
+
+def _flag(flag):
+    return lambda view: bool(view._catalog.columns['flags'][view._i] & flag)
+
+
+# how HutView reads each field from its catalog
+_FIELDS = {
+    'id': lambda view: view._catalog.columns['id'][view._i],
+    'lat': lambda view: view._catalog.columns['lat'][view._i],
+    'lng': lambda view: view._catalog.columns['lng'][view._i],
+    'facilities': lambda view: view._catalog.facilities(view._i),
+    'doc_maintained': _flag(FLAG_DOC_MAINTAINED),
+    'bookable': _flag(FLAG_BOOKABLE),
+    'island_code': lambda view: island_rank[view.island],
+    'region_code': lambda view: region_rank.get(view.region, len(region_rank)),
+    'place_code': lambda view: place_codes[view.place],
+    'thumbnail_src': lambda view: None,
+}
+_FIELDS.update((column, _category(column)) for column in CATEGORY_COLUMNS)
+_FIELDS.update((column, lambda view, column=column: view._catalog.string(column, view._i))
+               for column in STRING_COLUMNS)
+_FIELDS.update((column, lambda view, column=column: json.loads(view._catalog.string(column, view._i)))
+               for column in JSON_COLUMNS)
+
+
+class HutView(Hut):
+    '''A Hut whose fields are read from a ColumnarCatalog when accessed.
+    Fields can still be set (e.g. the visit data, by tag_with_trip), which
+    shadows the catalog's value for this view.'''
+
+    def __init__(self, catalog, i):
+        self._catalog = catalog
+        self._i = i
+        self.reset_visits()
+
+    def __getattr__(self, name):
+        # only called for attributes that haven't been set on the view
+        field = _FIELDS.get(name)
+        if field is None:
+            raise AttributeError(name)
+        return field(self)
+
+    def __reduce__(self):
+        state = {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
+        return _hut_view, (self._catalog.path, self._i), state
+
+
+def load_catalog(path=CATALOG_FILE):
+    '''Opens the columnar catalog at path, first (re)writing it from
+    all_huts() if it's missing or the data files have changed since.'''
+    with instrument.stage('load: columnar catalog'):
+        current = source_hash()
+        try:
+            catalog = ColumnarCatalog(path)
+            if catalog.header['source_sha256'] == current:
+                _catalogs[path] = catalog
+                return catalog
+        except (FileNotFoundError, ValueError):
+            pass
+        write_catalog(all_huts(), path, current)
+        _catalogs.pop(path, None)
+        return open_catalog(path)
+
+
+if __name__ == '__main__':
+    catalog = load_catalog()
+    print('{}: {} huts, {} bytes'.format(catalog.path, len(catalog), os.path.getsize(catalog.path)))
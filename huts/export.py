@@ -0,0 +1,255 @@
+'''
+Utility for exporting (enriched) huts in machine-readable formats, so that
+downstream tools don't need to scrape the checklist or map HTML.
+
+Two formats are supported:
+  - GeoJSON: a single FeatureCollection, one Point Feature per hut.
+  - JSON Lines: one JSON object (the same Feature) per line.
+
+Both writers stream: each hut is serialized and written as it is visited, so
+the whole document is never held in memory.
+
+Also exposes write_geojson_by_region, which writes one FeatureCollection per
+region into a directory (handy as input for vector tiling tools), and
+write_tiles, which buckets huts into slippy-map tiles so that a map page can
+fetch only the tiles in view.
+'''
+
+from collections import defaultdict
+import json
+import math
+import os
+import re
+import sys
+from datetime import timedelta
+
+from huts.hut import facility_bit
+
+
+def hut_properties(h):
+    '''Returns a JSON-serializable dict of the hut's attributes and, for
+    enriched huts, its visits.'''
+    visits = []
+    for t, hv in h.visits():
+        visits.append({
+            'arrival': hv.arrival.isoformat(),
+            'departure': (hv.arrival + timedelta(days=hv.num_days - 1)).isoformat(),
+            'nights': hv.num_days,
+            'sleep': hv.sleep,
+            'trip': t.desc,
+            'trip_start': t.start.isoformat(),
+            'trip_end': t.end.isoformat(),
+            'reports': list(t.reports),
+        })
+
+    return {
+        'id': h.id,
+        'name': h.name,
+        'place': h.place,
+        'region': h.region,
+        'island': h.island,
+        'url': h.url,
+        'facilities': h.facility_names(),
+        'bookable': h.bookable,
+        'doc_maintained': h.doc_maintained,
+        'provenance': h.provenance,
+        'visited': h.visited,
+        'sleep': h.sleep,
+        'visits': visits,
+    }
+
+
+def hut_feature(h):
+    return {
+        'type': 'Feature',
+        'properties': hut_properties(h),
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [h.lng, h.lat],
+        },
+    }
+
+
+def filter_huts(huts, island=None, region=None, visited=None, facilities=None, bookable=None):
+    '''Lazily filters huts. Each criterion is ignored when None. region may be
+    a single region name or a collection of region names; facilities is a
+    collection of facility names, all of which the huts must have.'''
+    if isinstance(region, str):
+        region = [region]
+    mask = None
+    if facilities:
+        if any(f not in facility_bit for f in facilities):
+            return
+        mask = sum(facility_bit[f] for f in facilities)
+    for h in huts:
+        if island is not None and h.island != island:
+            continue
+        if region is not None and h.region not in region:
+            continue
+        if visited is not None and h.visited != visited:
+            continue
+        if mask is not None and not h.has_facilities(mask):
+            continue
+        if bookable is not None and h.bookable != bookable:
+            continue
+        yield h
+
+
+def write_geojson(huts, f):
+    '''Writes huts to the file-like object f as a GeoJSON FeatureCollection,
+    one Feature per line. Returns the number of huts written.'''
+    count = 0
+    f.write('{"type": "FeatureCollection", "features": [\n')
+    for h in huts:
+        if count:
+            f.write(',\n')
+        f.write(json.dumps(hut_feature(h), ensure_ascii=False))
+        count += 1
+    f.write('\n]}\n')
+    return count
+
+
+def write_jsonl(huts, f):
+    '''Writes huts to the file-like object f as JSON Lines, one Feature per
+    line. Returns the number of huts written.'''
+    count = 0
+    for h in huts:
+        f.write(json.dumps(hut_feature(h), ensure_ascii=False))
+        f.write('\n')
+        count += 1
+    return count
+
+
+def region_filename(region):
+    '''"Hawke’s Bay" -> "hawkes_bay", "Nelson/Tasman" -> "nelson_tasman"'''
+    slug = re.sub(r'[^a-z0-9]+', '_', region.lower().replace(u'’', ''))
+    return slug.strip('_')
+
+
+def write_geojson_by_region(huts, out_dir):
+    '''Writes one GeoJSON FeatureCollection per region into out_dir. Returns
+    a dict mapping region to the filename written.'''
+    from huts.merged import by_region
+
+    os.makedirs(out_dir, exist_ok=True)
+    filenames = {}
+    for r, huts_in_region in by_region(huts).items():
+        filename = os.path.join(out_dir, '{}.geojson'.format(region_filename(r)))
+        with open(filename, 'w', encoding='utf-8') as f:
+            write_geojson(huts_in_region, f)
+        filenames[r] = filename
+    return filenames
+
+
+# Zoom levels written by write_tiles. At zoom 5 all of NZ fits in a handful of
+# tiles; by zoom 10 a tile is ~40km across and holds at most a few dozen huts.
+DEFAULT_TILE_ZOOMS = range(5, 11)
+
+def tile_xy(lat, lng, zoom):
+    '''Returns the (x, y) slippy-map tile coordinates (as used by OSM/Leaflet)
+    containing the given point at the given zoom.'''
+    n = 2 ** zoom
+    lat_rad = math.radians(lat)
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_point(h):
+    '''The compact per-hut record stored in a tile: just enough to draw a
+    marker and its popup.'''
+    return {
+        'lat': round(h.lat, 6),
+        'lng': round(h.lng, 6),
+        'name': h.name,
+        'url': h.url,
+        'place': h.place,
+        'region': h.region,
+        'visited': h.visited,
+        'dates': h.render_dates_visited(html=True) if h.visited else '',
+    }
+
+
+def write_tiles(huts, out_dir, zooms=DEFAULT_TILE_ZOOMS):
+    '''Writes huts into per-zoom, per-tile JSON buckets at
+    out_dir/<z>/<x>/<y>.json, plus out_dir/index.json listing the non-empty
+    tiles for each zoom (so that a viewer never requests empty tiles).
+    Returns the number of tile files written.'''
+    points = [(h.lat, h.lng, tile_point(h)) for h in huts]
+
+    # (an empty selection still gets an index)
+    os.makedirs(out_dir, exist_ok=True)
+    index = {}
+    count = 0
+    for z in zooms:
+        buckets = defaultdict(list)
+        for lat, lng, p in points:
+            buckets[tile_xy(lat, lng, z)].append(p)
+
+        for (x, y), bucket in buckets.items():
+            tile_dir = os.path.join(out_dir, str(z), str(x))
+            os.makedirs(tile_dir, exist_ok=True)
+            with open(os.path.join(tile_dir, '{}.json'.format(y)), 'w', encoding='utf-8') as f:
+                json.dump(bucket, f, ensure_ascii=False, separators=(',', ':'))
+            count += 1
+        index[z] = sorted('{}/{}'.format(x, y) for x, y in buckets)
+
+    with open(os.path.join(out_dir, 'index.json'), 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+    return count
+
+
+def add_arguments(parser):
+    '''Adds the export arguments (format, filters and output) to parser.'''
+    parser.add_argument('format', choices=['geojson', 'jsonl', 'tiles'])
+    parser.add_argument('--island')
+    parser.add_argument('--region', action='append',
+                        help='may be given more than once')
+    visited_group = parser.add_mutually_exclusive_group()
+    visited_group.add_argument('--visited', dest='visited', action='store_true', default=None)
+    visited_group.add_argument('--not-visited', dest='visited', action='store_false')
+    parser.add_argument('--facility', action='append',
+                        help='e.g. Heating, may be given more than once')
+    bookable_group = parser.add_mutually_exclusive_group()
+    bookable_group.add_argument('--bookable', dest='bookable', action='store_true', default=None)
+    bookable_group.add_argument('--not-bookable', dest='bookable', action='store_false')
+    parser.add_argument('-o', '--output', help='defaults to stdout')
+    parser.add_argument('--by-region', metavar='DIR',
+                        help='write one GeoJSON file per region into DIR')
+    parser.add_argument('--zoom', type=int, action='append',
+                        help='tile zoom level, may be given more than once '
+                             '(defaults to {}-{})'.format(DEFAULT_TILE_ZOOMS[0], DEFAULT_TILE_ZOOMS[-1]))
+
+
+def run(parser, args, huts):
+    '''Exports the (enriched) huts as asked by args, which were parsed with
+    the arguments from add_arguments.'''
+    huts = filter_huts(huts,
+                       island=args.island, region=args.region, visited=args.visited,
+                       facilities=args.facility, bookable=args.bookable)
+
+    if args.format == 'tiles':
+        if not args.output:
+            parser.error('tiles are written to a directory, pass one with --output')
+        count = write_tiles(huts, args.output, zooms=args.zoom or DEFAULT_TILE_ZOOMS)
+        print('Wrote {} tiles to directory: {}'.format(count, args.output), file=sys.stderr)
+    elif args.by_region:
+        for r, filename in write_geojson_by_region(huts, args.by_region).items():
+            print('Wrote {} huts to file: {}'.format(r, filename), file=sys.stderr)
+    else:
+        write = write_geojson if args.format == 'geojson' else write_jsonl
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                write(huts, f)
+        else:
+            write(huts, sys.stdout)
+
+
+if __name__ == '__main__':
+    import argparse
+    from huts.merged import huts_enriched_with_trips
+
+    parser = argparse.ArgumentParser(description='Export enriched huts.')
+    add_arguments(parser)
+    args = parser.parse_args()
+    run(parser, args, huts_enriched_with_trips())
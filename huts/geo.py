@@ -0,0 +1,139 @@
+'''
+Point-in-polygon lookups against boundary polygons shipped as GeoJSON in
+data/ (a FeatureCollection of Polygon/MultiPolygon features, each with a
+"name" property):
+  - islands.geojson, coarse hand-drawn outlines of the North and South Islands
+    (split through Cook Strait), used to assign an island to huts whose region
+    is unknown,
+  - regions.geojson, optional, DOC region boundaries. If present, the regions
+    of all DOC huts are assigned from it (override_region.json still wins).
+
+locate() is vectorized over all the points with numpy (imported on first
+use): each polygon's bounding box prefilters the points, then an even-odd
+crossing test runs over the remaining points and all the polygon's edges at
+once. Results are cached in .cache/, keyed on the hashes of the polygons file
+and of the points, so a catalog load only pays for the lookups when either
+changes.
+'''
+
+import hashlib
+import json
+import math
+import os
+
+from huts import instrument
+
+# NB not imported from huts.hut, which imports this module while loading
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+ISLANDS_FILE = os.path.join(BASE_DIR, 'data', 'islands.geojson')
+REGIONS_FILE = os.path.join(BASE_DIR, 'data', 'regions.geojson')
+CACHE_DIR = os.path.join(BASE_DIR, '.cache')
+
+# bounds the size of the (points x edges) arrays in _crossings
+CHUNK_SIZE = 1 << 20
+
+EARTH_RADIUS_KM = 6371
+
+
+def distance_km(a, b):
+    '''Great-circle (haversine) distance between two [lng, lat] points.'''
+    lng1, lat1, lng2, lat2 = map(math.radians, [a[0], a[1], b[0], b[1]])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+class Polygons(object):
+    '''The named polygons in a GeoJSON file. Each is kept as a flat array of
+    edges (all rings of all parts, so holes and multipolygons come out of
+    the even-odd rule) plus its bounding box.'''
+
+    def __init__(self, path):
+        import numpy as np
+
+        with open(path) as f:
+            features = json.load(f)['features']
+
+        self.names = []
+        self.edges = []
+        self.bboxes = []
+        for feature in features:
+            geom = feature['geometry']
+            if geom['type'] == 'Polygon':
+                rings = geom['coordinates']
+            elif geom['type'] == 'MultiPolygon':
+                rings = [ring for polygon in geom['coordinates'] for ring in polygon]
+            else:
+                raise ValueError('unsupported geometry type: {}'.format(geom['type']))
+
+            edges = []
+            for ring in rings:
+                ring = np.asarray(ring, dtype=float)[:, :2]
+                # [x1, y1, x2, y2] per edge, closing the ring if need be
+                edges.append(np.hstack([ring, np.roll(ring, -1, axis=0)]))
+            edges = np.vstack(edges)
+
+            self.names.append(feature['properties']['name'])
+            self.edges.append(edges)
+            self.bboxes.append((edges[:, 0].min(), edges[:, 1].min(), edges[:, 0].max(), edges[:, 1].max()))
+
+    def locate(self, lngs, lats):
+        '''Returns the name of the polygon containing each point (the first
+        one, if they overlap), or None.'''
+        import numpy as np
+
+        xs = np.asarray(lngs, dtype=float)
+        ys = np.asarray(lats, dtype=float)
+        result = np.full(len(xs), -1)
+        for i, (edges, (min_x, min_y, max_x, max_y)) in enumerate(zip(self.edges, self.bboxes)):
+            candidates = np.flatnonzero(
+                (result < 0) & (xs >= min_x) & (xs <= max_x) & (ys >= min_y) & (ys <= max_y))
+            instrument.count('point-in-polygon candidates', len(candidates))
+            if len(candidates):
+                inside = _crossings(edges, xs[candidates], ys[candidates]) % 2 == 1
+                result[candidates[inside]] = i
+        return [self.names[i] if i >= 0 else None for i in result]
+
+
+def _crossings(edges, xs, ys):
+    '''For each point, the number of polygon edges crossed by a ray going
+    east from it.'''
+    import numpy as np
+
+    x1, y1, x2, y2 = (edges[:, k] for k in range(4))
+    counts = np.zeros(len(xs), dtype=int)
+    step = max(1, CHUNK_SIZE // len(edges))
+    for start in range(0, len(xs), step):
+        x = xs[start:start + step, None]
+        y = ys[start:start + step, None]
+        straddles = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        counts[start:start + step] = (straddles & (x < x_cross)).sum(axis=1)
+    return counts
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def locate(polygons_file, points):
+    '''points is {key: (lng, lat)}. Returns {key: name of the polygon
+    containing the point, or None}, from the cache if possible.'''
+    if not points:
+        return {}
+    keys = list(points)
+    points_hash = hashlib.sha256(json.dumps([[k, points[k]] for k in keys]).encode('utf-8')).hexdigest()
+    cache_file = os.path.join(CACHE_DIR, 'geo.{}.{}.json'.format(
+        _file_hash(polygons_file)[:16], points_hash[:16]))
+    try:
+        with open(cache_file) as f:
+            names = json.load(f)
+    except (FileNotFoundError, ValueError):
+        with instrument.stage('load: point-in-polygon'):
+            names = Polygons(polygons_file).locate(
+                [points[k][0] for k in keys], [points[k][1] for k in keys])
+        from huts.output import atomic_write
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        atomic_write(cache_file, json.dumps(names))
+    return dict(zip(keys, names))
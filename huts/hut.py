@@ -1,8 +1,18 @@
 '''
 Defines the object representation of a Hut.
 Exposes a list of all DOC huts (and a few non-DOC huts) in New Zealand with all_huts().
+Every hut has a stable integer id (DOC's assetId, or the id in
+non_DOC_Huts.json), and a Catalog looks huts up by id, or resolves a name
+(and optional region) to an id, via the alias table in hut_aliases.json for
+huts that have been renamed.
 Exposes lists of places, regions, and islands, as well as definitive sort-orders
-for each.
+for each. The sort-orders are also exposed as ranks (island_rank, region_rank,
+place_rank: name -> position in the order), and every Hut carries the integer
+codes of its island/region/place. Places can be added as other datasets are
+loaded, which changes place_order and place_rank, so a hut's place_code is its
+place's entry in place_codes instead, which only ever has codes appended.
+Facilities are parsed into an interned vocabulary (facility_order), and each
+Hut carries them as an integer bitmask (see facility_mask).
 '''
 
 from collections import defaultdict
@@ -10,14 +20,25 @@ from datetime import timedelta
 import json
 import os.path
 
+from huts import instrument
+
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 DOC_HUTS_FILE = os.path.join(BASE_DIR, 'data', 'DOC_Huts.geojson')
 NON_DOC_HUTS_FILE = os.path.join(BASE_DIR, 'data', 'non_DOC_Huts.json')
 OVERRIDE_PLACE_FILE = os.path.join(BASE_DIR, 'data', 'override_place.json')
 OVERRIDE_REGION_FILE = os.path.join(BASE_DIR, 'data', 'override_region.json')
+HUT_ALIASES_FILE = os.path.join(BASE_DIR, 'data', 'hut_aliases.json')
+
+# the provenance of the huts from DOC_HUTS_FILE and NON_DOC_HUTS_FILE (see
+# huts.sources)
+DOC_SOURCE = 'doc'
+NON_DOC_SOURCE = 'non_doc'
 
 
 unknown_place = u'Unknown place'
+# for huts from other sources that don't say which region they're in, when
+# there are no region boundaries to look it up in (see huts.sources)
+unknown_region = u'Unknown region'
 
 regions_north = [
     u'Northland',
@@ -48,10 +69,9 @@ north_island = 'North Island'
 south_island = 'South Island'
 island_order = [north_island, south_island]
 
-# Huts with unknown region / island will be assigned an island based on whether
-# they're north or south of this latitude. NB this correctly classifies the
-# island as of 2019-04-20, but if the Unknown Region huts change over time, it
-# could incorrectly classify in the future.
+# Huts with unknown region / island are assigned an island by which polygon in
+# data/islands.geojson they're in (see _assign_from_polygons). Failing that
+# (e.g. a hut offshore), by whether they're north or south of this latitude.
 UNKNOWN_REGION_DIVIDING_LATITUDE = -41.3881
 def _lookup_island(region, lat):
     if region in regions_north:
@@ -65,6 +85,50 @@ def _lookup_island(region, lat):
         return south_island
 
 
+# The facilities in DOC's data, in bit order. Any others found when loading
+# are appended (so the bits of these stay put).
+facility_order = [
+    u'Cooking',
+    u'Heating',
+    u'Lighting',
+    u'Mattresses',
+    u'Toilets - flush',
+    u'Toilets - non-flush',
+    u'Water from stream',
+    u'Water from tap - not treated, boil before use',
+    u'Water from tap - treated, suitable for drinking',
+    u'Water supply',
+]
+facility_bit = {f: 1 << i for i, f in enumerate(facility_order)}
+
+def parse_facilities(facilities_str):
+    '''e.g. "Heating, Water from tap - not treated, boil before use" ->
+    ["Heating", "Water from tap - not treated, boil before use"]. Facilities
+    are separated by commas, but some contain commas themselves: a piece
+    that doesn't start with a capital letter continues the previous one.'''
+    result = []
+    for piece in (facilities_str or '').split(','):
+        piece = piece.strip()
+        if not piece:
+            continue
+        if result and not piece[0].isupper():
+            result[-1] = u'{}, {}'.format(result[-1], piece)
+        else:
+            result.append(piece)
+    return result
+
+def facility_mask(facilities):
+    '''The bitmask of the named facilities. Names not yet in the vocabulary
+    are added to it.'''
+    mask = 0
+    for f in facilities:
+        if f not in facility_bit:
+            facility_bit[f] = 1 << len(facility_order)
+            facility_order.append(f)
+        mask |= facility_bit[f]
+    return mask
+
+
 class Hut(object):
 
     def __str__(self):
@@ -72,6 +136,10 @@ class Hut(object):
 
     def matches(self, hut_visit):
         '''Decides if the specified hut_visit corresponds to this hut.'''
+        if hut_visit.hut_id is not None:
+            # already resolved, see Catalog.resolve_visit
+            return self.id == hut_visit.hut_id
+
         name_matches = (self.name == hut_visit.name)
         region_is_defined = bool(hut_visit.region)
         region_matches = (self.region == hut_visit.region)
@@ -100,6 +168,46 @@ class Hut(object):
             for v in matches:
                 self.sleep = v.sleep
 
+    def untag_trip(self, trip):
+        '''Mutate self, removing the HutVisit data from the supplied trip (the
+        inverse of tag_with_trip). Also idempotent.'''
+        if trip not in self.trips_tagged:
+            return
+        self.trips_tagged.remove(trip)
+        self.trips.remove(trip)
+
+        # recompute as if the remaining trips had been tagged in order
+        self.visited = bool(self.trips)
+        self.sleep = False
+        for t in self.trips:
+            if not self.sleep:
+                for v in filter(lambda hv: self.matches(hv), t.hut_visits):
+                    self.sleep = v.sleep
+
+    def reset_visits(self):
+        '''Forget all the Trip and HutVisit data, so the hut can be tagged
+        afresh.'''
+        self.trips_tagged = set([])
+        self.visited = False
+        self.trips = []
+        self.sleep = False
+
+    def visits(self):
+        '''Yields (Trip, HutVisit) pairs for every visit to this hut, in the
+        order the trips were tagged.'''
+        for t in self.trips:
+            for hv in t.hut_visits:
+                if self.matches(hv):
+                    yield t, hv
+
+    def has_facilities(self, mask):
+        '''Whether the hut has all the facilities in mask (see
+        facility_mask).'''
+        return self.facilities & mask == mask
+
+    def facility_names(self):
+        return [f for f in facility_order if self.facilities & facility_bit[f]]
+
     def render_name(self, html=False):
         if html and self.url:
             return u'<a href="{}">{}</a>'.format(self.url, self.name)
@@ -146,6 +254,8 @@ class Hut(object):
         props = obj['properties']
         geom = obj['geometry']
 
+        h.id = props['assetId']
+        h.global_id = props.get('GlobalID')
         h.name = props['name'].strip()
         h.place = props['place'] or unknown_place
         h.region = props['region']
@@ -153,14 +263,16 @@ class Hut(object):
         h.lat = geom['coordinates'][1]
         h.island = _lookup_island(h.region, h.lat)
         h.url = props['staticLink']
+        h.thumbnail = props.get('introductionThumbnail')
+        h.thumbnail_src = None
+        h.facilities = facility_mask(parse_facilities(props.get('facilities')))
+        h.bookable = props.get('bookable') == 'Yes'
+        h.provenance = [[DOC_SOURCE, h.id, h.name]]
 
         h.doc_maintained = doc_maintained
 
         # will be filled in later from HutVisit data
-        h.trips_tagged = set([])
-        h.visited = False
-        h.trips = []
-        h.sleep = False
+        h.reset_visits()
 
         return h
 
@@ -170,6 +282,8 @@ class Hut(object):
         that I have visited'''
         h = cls()
 
+        h.id = obj['id']
+        h.global_id = None
         h.name = obj['name']
         h.place = obj['place']
         h.region = obj['region']
@@ -177,18 +291,114 @@ class Hut(object):
         h.lng = obj['lng']
         h.lat = obj['lat']
         h.url = obj['staticLink']
+        h.thumbnail = obj.get('introductionThumbnail')
+        h.thumbnail_src = None
+        h.facilities = facility_mask(obj.get('facilities', []))
+        h.bookable = obj.get('bookable', False)
+        h.provenance = [[NON_DOC_SOURCE, h.id, h.name]]
 
         h.doc_maintained = doc_maintained
 
         # will be filled in later from HutVisit data
-        h.trips_tagged = set([])
-        h.visited = False
-        h.trips = []
-        h.sleep = False
+        h.reset_visits()
 
         return h
 
-def _doc_huts():
+class Catalog(object):
+    '''The huts, keyed on their ids. Also resolves the names (and optional
+    region disambiguators) used by HutVisits to ids, trying in order:
+      - the (name, region) pairs in the alias table,
+      - the names of the huts in the catalog,
+      - the (historical or alternate) names in the alias table, and the names
+        of the duplicates merged into each hut (see huts.sources).
+    Resolutions are cached.
+
+    hut_aliases.json has the form:
+        {
+            "names": {"<old name>": <id>, ...},
+            "name_regions": [["<old name>", "<region>", <id>], ...]
+        }
+    '''
+
+    def __init__(self, huts, aliases_file=HUT_ALIASES_FILE):
+        self.huts = huts
+        self.by_id = {}
+        self._ids_by_name = defaultdict(list)
+        for h in huts:
+            if h.id in self.by_id:
+                raise ValueError('duplicate hut id {}: {}, {}'.format(h.id, self.by_id[h.id], h))
+            self.by_id[h.id] = h
+            self._ids_by_name[h.name].append(h.id)
+
+        with open(aliases_file) as f:
+            aliases_json = json.load(f)
+        self.name_aliases = aliases_json['names']
+        for h in huts:
+            for _, _, name in h.provenance[1:]:
+                if name != h.name:
+                    self.name_aliases.setdefault(name, h.id)
+        self.name_region_aliases = {(name, region): hut_id for name, region, hut_id in aliases_json['name_regions']}
+
+        self._resolved = {}
+
+    def __getitem__(self, hut_id):
+        return self.by_id[hut_id]
+
+    def __contains__(self, hut_id):
+        return hut_id in self.by_id
+
+    def __iter__(self):
+        return iter(self.huts)
+
+    def __len__(self):
+        return len(self.huts)
+
+    def resolve(self, name, region=None):
+        '''Returns the id of the hut with the given name (in the given region,
+        if any).'''
+        key = (name, region)
+        if key not in self._resolved:
+            instrument.count('hut names resolved')
+            self._resolved[key] = self._resolve(name, region)
+        return self._resolved[key]
+
+    def _resolve(self, name, region):
+        if region and (name, region) in self.name_region_aliases:
+            ids = [self.name_region_aliases[(name, region)]]
+        elif name in self._ids_by_name:
+            ids = self._ids_by_name[name]
+        elif name in self.name_aliases:
+            ids = [self.name_aliases[name]]
+        else:
+            ids = []
+
+        ids = [i for i in ids if i in self.by_id]
+        if region:
+            # honor the "region" disambiguator, if present
+            ids = [i for i in ids if self.by_id[i].region == region]
+
+        if len(ids) == 0:
+            raise ValueError("hut doesn't exist: {}".format(name))
+        elif len(ids) > 1:
+            raise ValueError("multiple huts found: {}".format(', '.join(str(self.by_id[i]) for i in ids)))
+        [hut_id] = ids
+        return hut_id
+
+    def resolve_visit(self, hut_visit):
+        '''Returns the hut visited, and stores its id on the HutVisit (so
+        Hut.matches compares ids from then on).'''
+        hut_visit.hut_id = self.resolve(hut_visit.name, hut_visit.region)
+        return self.by_id[hut_visit.hut_id]
+
+
+def _doc_huts(doc_huts_file=DOC_HUTS_FILE):
+    huts_json = None
+    with instrument.stage('load: parse DOC huts GeoJSON'), open(doc_huts_file) as f:
+        huts_json = json.load(f)
+    return _doc_huts_from_features(huts_json['features'])
+
+def _doc_huts_from_features(huts_json_list):
+    '''Builds the Huts from the GeoJSON features, applying the overrides.'''
     override_place_json = None
     with open(OVERRIDE_PLACE_FILE) as f:
         override_place_json = json.load(f)
@@ -197,41 +407,102 @@ def _doc_huts():
     with open(OVERRIDE_REGION_FILE) as f:
         override_region_json = json.load(f)
 
-    huts_json = None
-    with open(DOC_HUTS_FILE) as f:
-        huts_json = json.load(f)
-    huts_json_list = huts_json['features']
-
     huts_list = []
-    for hj in huts_json_list:
-        hut = Hut.from_geojson(hj)
-        if hut.name in override_place_json:
-            hut.place = override_place_json[hut.name]
-        if hut.name in override_region_json:
-            hut.region = override_region_json[hut.name]
-        huts_list.append(hut)
+    with instrument.stage('load: build DOC huts'):
+        for hj in huts_json_list:
+            hut = Hut.from_geojson(hj)
+            if hut.name in override_place_json:
+                hut.place = override_place_json[hut.name]
+            huts_list.append(hut)
+        _assign_from_polygons(huts_list, override_region_json)
+    instrument.count('huts loaded', len(huts_list))
 
     return huts_list
 
-def _non_doc_huts():
+def _assign_from_polygons(huts, override_region_json):
+    '''Assigns regions from data/regions.geojson, if present, and islands from
+    data/islands.geojson to the huts whose region is unknown (see huts.geo).
+    The overrides win over both.'''
+    from huts import geo
+
+    if os.path.exists(geo.REGIONS_FILE):
+        regions = geo.locate(geo.REGIONS_FILE, {h.id: (h.lng, h.lat) for h in huts})
+        for h in huts:
+            h.region = regions[h.id] or h.region
+
+    for h in huts:
+        if h.name in override_region_json:
+            h.region = override_region_json[h.name]
+
+    unknown = [h for h in huts if h.region not in region_order]
+    islands = geo.locate(geo.ISLANDS_FILE, {h.id: (h.lng, h.lat) for h in unknown})
+    for h in huts:
+        h.island = islands.get(h.id) or _lookup_island(h.region, h.lat)
+
+def _non_doc_huts(non_doc_huts_file=NON_DOC_HUTS_FILE):
     huts_json = None
-    with open(NON_DOC_HUTS_FILE) as f:
+    with open(non_doc_huts_file) as f:
         huts_json = json.load(f)
 
     huts_list = []
     for h in huts_json:
         huts_list.append(Hut.from_json(h))
+    instrument.count('huts loaded', len(huts_list))
 
     return huts_list
 
-def all_huts():
-    return _doc_huts() + _non_doc_huts()
-
-_places = list(set(map(lambda h: h.place, all_huts())))
-place_order = sorted(_places)
-
-_regions = list(set(map(lambda h: h.region, all_huts())))
-assert len(_regions) == len(region_order)
+def _ranks(order):
+    return {c: i for i, c in enumerate(order)}
+
+def _merge_places(places):
+    '''Adds the places that aren't yet in place_order to it (and
+    place_rank), and gives them new place_codes. The codes of the places
+    already known don't change, so the huts (and indexes) already coded by
+    them stay valid.'''
+    new_places = set(places) - place_codes.keys()
+    if new_places:
+        for p in sorted(new_places):
+            place_codes[p] = len(place_codes)
+        place_order[:] = sorted(new_places.union(place_order))
+        place_rank.clear()
+        place_rank.update(_ranks(place_order))
+
+def _intern(huts):
+    '''Sets each hut's island_code, region_code (its category's rank in
+    island_order/region_order) and place_code (see place_codes), so that
+    grouping and filtering are integer comparisons. Places that aren't yet in
+    place_order (e.g. from a different dataset) are merged into it.'''
+    _merge_places(set(h.place for h in huts))
+
+    unknown_region_code = len(region_rank)
+    for h in huts:
+        h.island_code = island_rank[h.island]
+        h.region_code = region_rank.get(h.region, unknown_region_code)
+        h.place_code = place_codes[h.place]
+    return huts
+
+def _load_huts(doc_huts_file=DOC_HUTS_FILE, non_doc_huts_file=NON_DOC_HUTS_FILE):
+    '''The huts federated from the DOC and non-DOC files, plus any other
+    sources in data/sources.json (see huts.sources).'''
+    from huts import sources
+    huts, _ = sources.federate(sources.default_sources(doc_huts_file, non_doc_huts_file))
+    return huts
+
+def all_huts(doc_huts_file=DOC_HUTS_FILE, non_doc_huts_file=NON_DOC_HUTS_FILE):
+    '''The data files can be swapped out (e.g. for synthetic datasets when
+    benchmarking), but default to the real ones in data/.'''
+    return _intern(_load_huts(doc_huts_file, non_doc_huts_file))
+
+# The places are those of the huts loaded so far: all_huts() (via _intern)
+# and huts.columnar merge theirs in as they load, so importing this module
+# doesn't read the data files.
+place_order = []
+
+island_rank = _ranks(island_order)
+region_rank = _ranks(region_order)
+place_rank = _ranks(place_order)
+# place -> code; unlike place_rank, codes never change once given out
+place_codes = _ranks(place_order)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,289 @@
+'''
+Imports a new export of the DOC huts dataset (see the README for where it's
+downloaded from) in place of data/DOC_Huts.geojson.
+
+The new export is diffed against the current catalog by hut id (assetId), in
+one pass over the new export: each feature is hashed, and only the huts whose
+hash differs from the catalog snapshot are compared field by field. Reports:
+  - huts added, removed, renamed, moved, reclassified (region or place), or
+    otherwise updated (e.g. facilities),
+  - entries in override_place.json/override_region.json that no longer apply
+    (no hut has that name any more) or are redundant (DOC now agrees),
+  - entries in hut_aliases.json pointing at huts that no longer exist,
+  - hut visits in trips.py that would no longer resolve to a hut.
+
+The catalog snapshot ({hut id: feature hash and fields}) is cached in
+.cache/catalog_snapshot.json, keyed on the hash of DOC_Huts.geojson, so the
+current catalog isn't re-hashed on every import. With --apply, the new export
+replaces DOC_Huts.geojson, the old names of renamed huts are added to
+hut_aliases.json, and the snapshot is updated in place (only the huts that
+changed).
+
+Usage:
+    PYTHONPATH=. python3 huts/importer.py ~/Downloads/DOC_Huts.geojson [--apply]
+'''
+
+import hashlib
+import json
+import os
+import sys
+
+from huts.hut import (
+    BASE_DIR, DOC_HUTS_FILE,
+    OVERRIDE_PLACE_FILE, OVERRIDE_REGION_FILE, HUT_ALIASES_FILE,
+    Catalog, _doc_huts_from_features, _non_doc_huts,
+)
+from huts.geo import distance_km
+from huts.output import atomic_write, file_hash
+
+CACHE_DIR = os.path.join(BASE_DIR, '.cache')
+SNAPSHOT_FILE = os.path.join(CACHE_DIR, 'catalog_snapshot.json')
+
+# properties that change with every export without the hut changing
+IGNORED_PROPERTIES = {'OBJECTID', 'dateLoadedToGIS', 'x', 'y'}
+RECLASSIFYING_PROPERTIES = ['region', 'place']
+
+# coordinates closer than this (in km) are the same
+MOVE_TOLERANCE_KM = 0.01
+
+
+def _entry(feature):
+    '''The snapshot entry of a feature: its hash and the fields that matter.'''
+    props = {k: v for k, v in feature['properties'].items() if k not in IGNORED_PROPERTIES}
+    coordinates = feature['geometry']['coordinates']
+    digest = hashlib.sha256(json.dumps([props, coordinates], sort_keys=True).encode('utf-8')).hexdigest()
+    return {'hash': digest, 'properties': props, 'coordinates': coordinates}
+
+
+def _name(props):
+    '''The hut's name as the catalog has it (see Hut.from_geojson), which the
+    overrides and aliases are keyed on: the export has some with stray
+    whitespace.'''
+    return props['name'].strip()
+
+
+def snapshot(features):
+    '''Returns {hut id (as a str, like JSON keys): snapshot entry}.'''
+    return {str(f['properties']['assetId']): _entry(f) for f in features}
+
+
+def _read_features(path):
+    with open(path) as f:
+        return json.load(f)['features']
+
+
+def load_snapshot(doc_huts_file=DOC_HUTS_FILE, snapshot_file=SNAPSHOT_FILE):
+    '''Returns the snapshot of doc_huts_file, from the cache if it's up to
+    date, else built afresh (and cached).'''
+    source_hash = file_hash(doc_huts_file)
+    try:
+        with open(snapshot_file) as f:
+            cached = json.load(f)
+        if cached['source_sha256'] == source_hash:
+            return cached['huts']
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    huts = snapshot(_read_features(doc_huts_file))
+    save_snapshot(huts, source_hash, snapshot_file)
+    return huts
+
+
+def save_snapshot(huts, source_hash, snapshot_file=SNAPSHOT_FILE):
+    os.makedirs(os.path.dirname(snapshot_file), exist_ok=True)
+    atomic_write(snapshot_file, json.dumps({'source_sha256': source_hash, 'huts': huts}))
+
+
+class CatalogDiff(object):
+    '''The differences between two snapshots. Each list holds (hut id, old
+    entry, new entry) tuples (with None for the missing side of added and
+    removed huts); a hut can be in several of renamed/moved/reclassified/
+    updated.'''
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        self.added = []
+        self.removed = []
+        self.renamed = []
+        self.moved = []
+        self.reclassified = []
+        self.updated = []
+
+        for hut_id, entry in new.items():
+            old_entry = old.get(hut_id)
+            if old_entry is None:
+                self.added.append((hut_id, None, entry))
+            elif old_entry['hash'] != entry['hash']:
+                self._compare(hut_id, old_entry, entry)
+        for hut_id, old_entry in old.items():
+            if hut_id not in new:
+                self.removed.append((hut_id, old_entry, None))
+
+    def _compare(self, hut_id, old_entry, entry):
+        change = (hut_id, old_entry, entry)
+        old_props, props = old_entry['properties'], entry['properties']
+        if _name(old_props) != _name(props):
+            self.renamed.append(change)
+        if distance_km(old_entry['coordinates'], entry['coordinates']) > MOVE_TOLERANCE_KM:
+            self.moved.append(change)
+        if any(old_props.get(k) != props.get(k) for k in RECLASSIFYING_PROPERTIES):
+            self.reclassified.append(change)
+        if self._other_changes(old_props, props):
+            self.updated.append(change)
+
+    @staticmethod
+    def _other_changes(old_props, props):
+        keys = set(old_props).union(props) - set(['name'] + RECLASSIFYING_PROPERTIES)
+        return sorted(k for k in keys if old_props.get(k) != props.get(k))
+
+    def changed_ids(self):
+        return set(hut_id for changes in [self.renamed, self.moved, self.reclassified, self.updated]
+                   for hut_id, _, _ in changes)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed_ids())
+
+    def report(self, f=sys.stdout):
+        def describe(entry):
+            props = entry['properties']
+            return u'{} ({}, {})'.format(props['name'], props['region'], props['place'])
+
+        sections = [
+            ('Added', self.added, lambda old, new: describe(new)),
+            ('Removed', self.removed, lambda old, new: describe(old)),
+            ('Renamed', self.renamed, lambda old, new: u'{} -> {}'.format(
+                old['properties']['name'], new['properties']['name'])),
+            ('Moved', self.moved, lambda old, new: u'{}: {:.2f} km'.format(
+                new['properties']['name'], distance_km(old['coordinates'], new['coordinates']))),
+            ('Reclassified', self.reclassified, lambda old, new: u'{}: {}'.format(
+                new['properties']['name'], '; '.join(
+                    u'{} {} -> {}'.format(k, old['properties'].get(k), new['properties'].get(k))
+                    for k in RECLASSIFYING_PROPERTIES if old['properties'].get(k) != new['properties'].get(k)))),
+            ('Updated', self.updated, lambda old, new: u'{}: {}'.format(
+                new['properties']['name'], ', '.join(self._other_changes(old['properties'], new['properties'])))),
+        ]
+        for title, changes, fmt in sections:
+            if not changes:
+                continue
+            f.write(u'{} ({}):\n'.format(title, len(changes)))
+            for hut_id, old, new in changes:
+                f.write(u'    {} [{}]\n'.format(fmt(old, new), hut_id))
+
+
+def stale_overrides(new):
+    '''Returns a list of messages about override entries that no longer
+    apply to the huts in the new snapshot.'''
+    props_by_name = {}
+    for entry in new.values():
+        props_by_name.setdefault(_name(entry['properties']), []).append(entry['properties'])
+
+    messages = []
+    for filename, field in [(OVERRIDE_PLACE_FILE, 'place'), (OVERRIDE_REGION_FILE, 'region')]:
+        with open(filename) as f:
+            overrides = json.load(f)
+        for name, value in overrides.items():
+            matches = props_by_name.get(name, [])
+            if not matches:
+                messages.append(u'{}: "{}": no hut has that name'.format(os.path.basename(filename), name))
+            elif all(props[field] == value for props in matches):
+                messages.append(u'{}: "{}": redundant, DOC now has {} "{}"'.format(
+                    os.path.basename(filename), name, field, value))
+    return messages
+
+
+def stale_aliases(new, non_doc_ids, aliases_file=HUT_ALIASES_FILE):
+    with open(aliases_file) as f:
+        aliases_json = json.load(f)
+    aliases = [(name, None, hut_id) for name, hut_id in aliases_json['names'].items()]
+    aliases += [tuple(a) for a in aliases_json['name_regions']]
+
+    messages = []
+    for name, region, hut_id in aliases:
+        if str(hut_id) not in new and hut_id not in non_doc_ids:
+            messages.append(u'{}: "{}"{}: no hut has id {}'.format(
+                os.path.basename(aliases_file), name, ' ({})'.format(region) if region else '', hut_id))
+    return messages
+
+
+def _rename_aliases(diff):
+    return {_name(old['properties']): int(hut_id) for hut_id, old, _ in diff.renamed}
+
+
+def unresolved_visits(new_features, diff, trips=None):
+    '''Returns a list of messages about the hut visits in trips (default: all
+    trips) that don't resolve to a hut in the new export (even with the
+    aliases that apply() adds for renamed huts).'''
+    from huts.trips import all_trips
+    if trips is None:
+        trips = all_trips()
+
+    catalog = Catalog(_doc_huts_from_features(new_features) + _non_doc_huts())
+    for name, hut_id in _rename_aliases(diff).items():
+        catalog.name_aliases.setdefault(name, hut_id)
+    messages = []
+    for t in trips:
+        for hv in t.hut_visits:
+            try:
+                catalog.resolve(hv.name, hv.region)
+            except ValueError as e:
+                messages.append(u'{} ({}): {}'.format(t.desc, hv.arrival, e))
+    return messages
+
+
+def add_rename_aliases(diff, aliases_file=HUT_ALIASES_FILE):
+    '''Adds the old name of every renamed hut to the alias table, so trips
+    recorded under the old name still resolve.'''
+    with open(aliases_file) as f:
+        aliases_json = json.load(f)
+    for name, hut_id in _rename_aliases(diff).items():
+        aliases_json['names'].setdefault(name, hut_id)
+    atomic_write(aliases_file, json.dumps(aliases_json, indent=4, ensure_ascii=False) + '\n')
+
+
+def apply(new_file, diff, doc_huts_file=DOC_HUTS_FILE, snapshot_file=SNAPSHOT_FILE):
+    '''Replaces doc_huts_file with new_file, and updates the snapshot (only
+    the entries that changed) and the alias table.'''
+    with open(new_file, 'rb') as f:
+        atomic_write(doc_huts_file, f.read())
+
+    huts = diff.old
+    for hut_id, _, _ in diff.removed:
+        del huts[hut_id]
+    for hut_id in diff.changed_ids().union(hut_id for hut_id, _, _ in diff.added):
+        huts[hut_id] = diff.new[hut_id]
+    save_snapshot(huts, file_hash(doc_huts_file), snapshot_file)
+
+    if diff.renamed:
+        add_rename_aliases(diff)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Diff (and import) a new DOC huts export.')
+    parser.add_argument('new_file', help='the new export, in the same format as data/DOC_Huts.geojson')
+    parser.add_argument('--apply', action='store_true', help='replace data/DOC_Huts.geojson with it')
+    args = parser.parse_args()
+
+    old = load_snapshot()
+    new_features = _read_features(args.new_file)
+    new = snapshot(new_features)
+    diff = CatalogDiff(old, new)
+
+    if diff:
+        diff.report()
+    else:
+        print('No changes to the huts.')
+
+    problems = stale_overrides(new)
+    problems += stale_aliases(new, set(h.id for h in _non_doc_huts()))
+    problems += unresolved_visits(new_features, diff)
+    if problems:
+        print('Needs attention ({}):'.format(len(problems)))
+        for message in problems:
+            print(u'    {}'.format(message))
+
+    if args.apply:
+        apply(args.new_file, diff)
+        print('Imported {} huts to file: {}'.format(len(new), DOC_HUTS_FILE))
@@ -0,0 +1,119 @@
+'''
+Lightweight instrumentation for the build pipeline: per-stage timers and
+counters (huts loaded, visits matched, hut names resolved, markers emitted,
+bytes written, ...).
+
+Instrumentation is off by default, and when off stage() and count() return
+immediately. Turn it on with the HUTS_PROFILE environment variable or the
+--profile flag of the entry points (checklist.py, map.py):
+
+    HUTS_PROFILE=1            print a per-stage table to stderr when done
+    HUTS_PROFILE=out.json     ... and also dump the timings/counters as JSON
+    HUTS_PROFILE=out.prof     ... and also run cProfile, dumping its stats
+                              (view with `python3 -m pstats out.prof`)
+
+--profile and --profile=<path> behave the same way.
+'''
+
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+import sys
+import time
+
+ENV_VAR = 'HUTS_PROFILE'
+FLAG = '--profile'
+
+enabled = False
+_output = None
+_profiler = None
+
+timings = defaultdict(float)
+calls = defaultdict(int)
+counters = defaultdict(int)
+
+
+def enable(output=None):
+    '''Turns instrumentation on. output is an optional .json or .prof path
+    (see the module docstring).'''
+    global enabled, _output, _profiler
+    enabled = True
+    _output = output
+    if output and output.endswith('.prof'):
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def _enable_from_setting(setting):
+    if setting and setting != '0':
+        enable(None if setting == '1' else setting)
+
+
+def configure(argv=sys.argv):
+    '''Enables instrumentation if requested by a --profile flag in argv. The
+    flag is removed from argv (in place) so the caller's own argument handling
+    doesn't see it. (The environment variable is checked at import time, so
+    that work done while importing, e.g. loading the huts, is measured too.)'''
+    for arg in list(argv[1:]):
+        if arg == FLAG or arg.startswith(FLAG + '='):
+            argv.remove(arg)
+            if not enabled:
+                _enable_from_setting(arg.partition('=')[2] or '1')
+
+
+@contextmanager
+def stage(name):
+    '''Times the enclosed block, accumulating into timings[name].'''
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] += time.perf_counter() - start
+        calls[name] += 1
+
+
+def count(name, n=1):
+    if enabled:
+        counters[name] += n
+
+
+def count_bytes_written(filename):
+    if enabled:
+        counters['bytes written'] += os.path.getsize(filename)
+
+
+def report(f=sys.stderr):
+    '''Writes a table of the stage timings and counters to f.'''
+    width = max(map(len, list(timings) + list(counters) + ['stage']))
+    f.write('{:<{w}} {:>6} {:>10}\n'.format('stage', 'calls', 'seconds', w=width))
+    for name, seconds in timings.items():
+        f.write('{:<{w}} {:>6} {:>10.4f}\n'.format(name, calls[name], seconds, w=width))
+    if counters:
+        f.write('\n{:<{w}} {:>17}\n'.format('counter', 'value', w=width))
+        for name, value in counters.items():
+            f.write('{:<{w}} {:>17}\n'.format(name, value, w=width))
+
+
+def finish():
+    '''Call at the end of an entry point: prints the report and writes the
+    requested JSON or cProfile dump, if instrumentation is enabled.'''
+    if not enabled:
+        return
+    if _profiler:
+        _profiler.disable()
+        _profiler.dump_stats(_output)
+    elif _output:
+        with open(_output, 'w') as f:
+            json.dump({
+                'stages': {name: {'seconds': timings[name], 'calls': calls[name]} for name in timings},
+                'counters': counters,
+            }, f, indent=2)
+    report()
+
+
+_enable_from_setting(os.environ.get(ENV_VAR))
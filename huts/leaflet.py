@@ -0,0 +1,138 @@
+'''
+A lightweight alternative to huts.map.maps that writes the Leaflet map pages
+directly, without going through folium's object model.
+
+Instead of one Marker/Icon/Popup/FeatureGroup element (each rendered through
+a jinja2 template) per hut, each page embeds one compact data array of huts
+and a small static script that builds the markers in the browser. The layers
+are the same as huts.map's (one "<region> - Visited" layer, shown, and one
+"<region> - Not visited" layer, hidden, per region), and the page has the same
+structure as folium's output, so xform_map_for_website.sh and its overlayadd
+handler work on either. Likewise, layers can be loaded on demand (see
+huts.map.layer_shards).
+'''
+
+import re
+from string import Template
+
+from huts import instrument
+from huts.map import (
+    ISLAND_FOCUS, ICON_HUT, COLOR_HUT_VISITED, COLOR_HUT_NOT_VISITED,
+    _location_and_zoom, _island_regions, _js, layer_name, layer_loader_js, popup_html,
+)
+
+# NB xform_map_for_website.sh relies on this layout: the first <link> line,
+# the "#map_<id> {" style (whose next two lines are position and width), the
+# folium-map div on a single line, and the last two lines of the file.
+PAGE_TEMPLATE = Template('''<!DOCTYPE html>
+<head>
+    <meta http-equiv="content-type" content="text/html; charset=UTF-8" />
+    <script src="https://cdn.jsdelivr.net/npm/leaflet@1.6.0/dist/leaflet.js"></script>
+    <script src="https://code.jquery.com/jquery-1.12.4.min.js"></script>
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/Leaflet.awesome-markers/2.0.2/leaflet.awesome-markers.js"></script>
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.6.0/dist/leaflet.css"/>
+    <link rel="stylesheet" href="https://maxcdn.bootstrapcdn.com/bootstrap/3.2.0/css/bootstrap.min.css"/>
+    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/Leaflet.awesome-markers/2.0.2/leaflet.awesome-markers.css"/>
+    <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no" />
+    <style>html, body {width: 100%;height: 100%;margin: 0;padding: 0;}</style>
+    <style>
+        #$map_id {
+            position: relative;
+            width: 100.0%;
+            height: 100.0%;
+            left: 0.0%;
+            top: 0.0%;
+        }
+    </style>
+</head>
+<body>
+    <div class="folium-map" id="$map_id" ></div>
+</body>
+<script>
+    var $map_id = L.map("$map_id", {center: $center, zoom: $zoom, zoomControl: true});
+    L.control.scale().addTo($map_id);
+    var hut_layers = $layers;
+    var hut_data = $huts;
+    var hut_icons = $icons.map(function(color) {
+        return L.AwesomeMarkers.icon({icon: "$icon", iconColor: "white", markerColor: color, prefix: "glyphicon"});
+    });
+    var hut_groups = hut_layers.map(function(layer) {
+        var group = L.featureGroup();
+        if (layer[1]) {
+            group.addTo($map_id);
+        }
+        return group;
+    });
+    hut_data.forEach(function(h) {
+        L.marker([h[0], h[1]], {icon: hut_icons[h[3]]})
+            .bindPopup(h[4], {maxWidth: 150})
+            .addTo(hut_groups[h[2]]);
+    });
+$loader
+    var base_layers = {
+        "openstreetmap": L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png",
+            {attribution: "Data by &copy; <a href=\\"http://openstreetmap.org\\">OpenStreetMap</a>, under <a href=\\"http://www.openstreetmap.org/copyright\\">ODbL</a>.", maxZoom: 18}),
+        "stamenterrain": L.tileLayer("https://stamen-tiles-{s}.a.ssl.fastly.net/terrain/{z}/{x}/{y}.jpg",
+            {attribution: "Map tiles by <a href=\\"http://stamen.com\\">Stamen Design</a>, under <a href=\\"http://creativecommons.org/licenses/by/3.0\\">CC BY 3.0</a>. Data by &copy; <a href=\\"http://openstreetmap.org\\">OpenStreetMap</a>, under <a href=\\"http://creativecommons.org/licenses/by-sa/3.0\\">CC BY SA</a>.", maxZoom: 18}),
+    };
+    base_layers["openstreetmap"].addTo($map_id);
+    var overlays = {};
+    hut_layers.forEach(function(layer, i) {
+        overlays[layer[0]] = hut_groups[i];
+    });
+    L.control.layers(base_layers, overlays, {autoZIndex: true, collapsed: true, position: "topright"}).addTo($map_id);
+
+</script>''')
+
+
+def _map_id(island):
+    return 'map_' + re.sub(r'[^a-z0-9]', '', island.lower())
+
+
+def render_map(island, huts, layer_urls=None):
+    '''Returns the HTML page for the given island, depicting the given huts
+    (which should all be on that island). The huts in layer_urls ({layer name:
+    url}) are loaded on demand instead.'''
+    layer_urls = layer_urls or {}
+    regions_to_render = set(h.region for h in huts)
+
+    # one [name, shown] pair per layer, in the same order as huts.map's
+    layers = []
+    layer_index = {}
+    for r in filter(lambda r: r in regions_to_render, _island_regions(island)):
+        for visited in (True, False):
+            layer_index[(r, visited)] = len(layers)
+            layers.append([layer_name(r, visited), visited])
+
+    # [lat, lng, layer, icon, popup]
+    data = []
+    for h in huts:
+        if layer_name(h.region, h.visited) in layer_urls:
+            continue
+        data.append([round(h.lat, 6), round(h.lng, 6), layer_index[(h.region, h.visited)],
+                     int(h.visited), popup_html(h)])
+        instrument.count('markers emitted')
+
+    island_layer_urls = {name: layer_urls[name] for name, _ in layers if name in layer_urls}
+
+    center, zoom = _location_and_zoom(ISLAND_FOCUS[island])
+    return PAGE_TEMPLATE.substitute(
+        map_id=_map_id(island),
+        center=_js(center),
+        zoom=zoom,
+        layers=_js(layers),
+        huts=_js(data),
+        icons=_js([COLOR_HUT_NOT_VISITED, COLOR_HUT_VISITED]),
+        icon=ICON_HUT,
+        loader=layer_loader_js(island_layer_urls) if island_layer_urls else '',
+    )
+
+
+def maps(huts_with_trip_data, layer_urls=None):
+    '''Like huts.map.maps, but returns a dict with island names for keys and
+    the rendered HTML pages for values.'''
+    with instrument.stage('map: build native'):
+        by_island = {i: [] for i in ISLAND_FOCUS}
+        for h in huts_with_trip_data:
+            by_island[h.island].append(h)
+        return {i: render_map(i, huts, layer_urls) for i, huts in by_island.items()}
@@ -0,0 +1,249 @@
+'''
+Checks the trip report links (TRIP_REPORTS in huts/trips.py), so that dead
+ones can be left out of the checklist and map popups without any network I/O
+at build time.
+
+Each link is fetched (following redirects) and recorded in
+.cache/link_status.json as one of:
+  - ok, it loaded (2xx),
+  - private, it redirected to a login page (e.g. a Strava activity that
+    isn't public),
+  - dead, 404/410, or its host doesn't exist any more (the resolver says
+    there's no such name),
+  - error, anything else (timeouts, 5xx, rate limited, other resolver
+    failures, ...), which may well be transient.
+Each status is rechecked once it's older than its TTL (see TTL_DAYS), so a
+rerun only checks the links that are new or due. A link is only taken to be
+dead once it has been found dead by DEAD_CHECKS separate checks; until then
+it's rechecked as often as an error.
+
+If no request in a run gets an HTTP response (e.g. the network is down),
+that's taken as an outage rather than a verdict on the links, and nothing is
+recorded.
+
+Requests go through the
+mirror's HttpClient (see huts/mirror.py): a bounded number in flight, and
+requests to the same host spaced out by --host-interval seconds.
+
+hide_dead_links(trips) drops the links confirmed dead from the trips' reports
+(using only the cache); the build, checklist and map entry points do so.
+
+--origin checks every link against the given origin instead of its own (e.g. a
+local mock server, see benchmarks/links.py), and only follows redirects that
+stay on it; the cache is still keyed on the original URLs.
+
+Usage:
+    PYTHONPATH=. python3 huts/links.py [--concurrency 8] [--host-interval 1] [--all]
+                                       [--origin http://127.0.0.1:8000] [--cache-file FILE]
+'''
+
+import json
+import os
+import socket
+import time
+from urllib.parse import urlsplit
+
+from huts.hut import BASE_DIR
+from huts.output import atomic_write
+
+LINK_STATUS_FILE = os.path.join(BASE_DIR, '.cache', 'link_status.json')
+
+OK = 'ok'
+PRIVATE = 'private'
+DEAD = 'dead'
+ERROR = 'error'
+
+# how long each status is trusted for before the link is checked again
+TTL_DAYS = {OK: 30, PRIVATE: 7, DEAD: 7, ERROR: 1}
+# how many checks in a row must find a link dead before it's hidden
+DEAD_CHECKS = 2
+
+DEAD_STATUS_CODES = {404, 410}
+LOGIN_PATHS = ('/login', '/signin', '/accounts/login', '/accountlogin')
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_HOST_INTERVAL = 1.0
+DEFAULT_TIMEOUT = 30
+SAVE_EVERY = 20
+
+
+def classify(status, final_url):
+    '''The link status for a response with the given HTTP status, from
+    final_url (after any redirects).'''
+    if status in DEAD_STATUS_CODES:
+        return DEAD
+    if 200 <= status < 300:
+        if urlsplit(final_url).path.lower().rstrip('/').endswith(LOGIN_PATHS):
+            return PRIVATE
+        return OK
+    return ERROR
+
+
+class LinkCache(object):
+    '''The recorded status of each link: {url: {"status": ..., "code": HTTP
+    status or null, "checked": unix time, "message": ..., "dead_checks": the
+    number of checks in a row that found it dead}}.'''
+
+    def __init__(self, path=LINK_STATUS_FILE):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.links = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.links = {}
+
+    def status(self, url):
+        '''The last recorded status of url (however old), or None.'''
+        entry = self.links.get(url)
+        return entry['status'] if entry else None
+
+    def is_due(self, url, now=None):
+        '''Whether url has never been checked, or its status has expired.'''
+        entry = self.links.get(url)
+        if entry is None:
+            return True
+        now = time.time() if now is None else now
+        status = entry['status']
+        if status == DEAD and not self.is_confirmed_dead(url):
+            status = ERROR
+        return now - entry['checked'] > TTL_DAYS[status] * 86400
+
+    def is_confirmed_dead(self, url):
+        entry = self.links.get(url)
+        return bool(entry) and entry['status'] == DEAD and entry.get('dead_checks', 0) >= DEAD_CHECKS
+
+    def record(self, url, status, code=None, message=None):
+        dead_checks = 0
+        if status == DEAD:
+            previous = self.links.get(url)
+            dead_checks = 1 + (previous.get('dead_checks', 0) if previous and previous['status'] == DEAD else 0)
+        self.links[url] = {'status': status, 'code': code, 'checked': time.time(), 'message': message,
+                           'dead_checks': dead_checks}
+
+    def dead_links(self):
+        '''The links confirmed dead (see DEAD_CHECKS).'''
+        return set(url for url in self.links if self.is_confirmed_dead(url))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        atomic_write(self.path, json.dumps(self.links, indent=1, sort_keys=True))
+
+
+def hide_dead_links(trips, cache=None):
+    '''Removes the links confirmed dead (see LinkCache.dead_links) from the
+    trips' reports, in place. Returns the trips.'''
+    if cache is None:
+        if not os.path.exists(LINK_STATUS_FILE):
+            return trips
+        cache = LinkCache()
+    dead = cache.dead_links()
+    if dead:
+        for t in trips:
+            if any(url in dead for url in t.reports):
+                t.reports = tuple(url for url in t.reports if url not in dead)
+    return trips
+
+
+def report_urls(trips):
+    return list(dict.fromkeys(url for t in trips for url in t.reports))
+
+
+class LinkChecker(object):
+    '''Checks links, recording their statuses in a LinkCache.'''
+
+    def __init__(self, cache, origin=None, concurrency=DEFAULT_CONCURRENCY,
+                 host_interval=DEFAULT_HOST_INTERVAL, timeout=DEFAULT_TIMEOUT):
+        self.cache = cache
+        self.origin = origin
+        self.concurrency = concurrency
+        self.host_interval = host_interval
+        self.timeout = timeout
+        # whether the last check() was taken to be an outage
+        self.outage = False
+
+    def _check_url(self, url):
+        if not self.origin:
+            return url
+        parts = urlsplit(url)
+        return self.origin.rstrip('/') + parts.path + ('?' + parts.query if parts.query else '')
+
+    def check(self, urls, force=False):
+        '''Checks the urls that are due (or all of them, with force), and
+        records their statuses in the cache. Returns {url: status} for the
+        urls checked (nothing, if none of them got a response; see
+        outage).'''
+        # (only needed to check links, not to hide the dead ones)
+        from concurrent.futures import as_completed
+        import http.client
+        from huts.mirror import HttpClient, MirrorError
+
+        urls = [u for u in urls if force or self.cache.is_due(u)]
+        client = HttpClient(self.concurrency, self.timeout, self.host_interval, origin=self.origin)
+        results = {}
+        # the failures without an HTTP response, (url, status, message); only
+        # recorded if some request got a response
+        unreachable = []
+        try:
+            futures = {client.submit(self._check_url(url)): url for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    final_url, code, _, _ = future.result()
+                except socket.gaierror as e:
+                    status = DEAD if e.errno == socket.EAI_NONAME else ERROR
+                    unreachable.append((url, status, 'host not found: {}'.format(e)))
+                    continue
+                except (OSError, http.client.HTTPException, MirrorError, ValueError) as e:
+                    unreachable.append((url, ERROR, str(e) or type(e).__name__))
+                    continue
+                self.cache.record(url, classify(code, final_url), code)
+                results[url] = self.cache.status(url)
+                if len(results) % SAVE_EVERY == 0:
+                    self.cache.save()
+        finally:
+            client.close()
+            self.outage = bool(unreachable) and not results
+            if not self.outage:
+                for url, status, message in unreachable:
+                    self.cache.record(url, status, message=message)
+                    results[url] = status
+            self.cache.save()
+        return results
+
+
+if __name__ == '__main__':
+    import argparse
+    from collections import Counter
+
+    from huts.trips import all_trips
+
+    parser = argparse.ArgumentParser(description='Check the trip report links.')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='the most requests in flight at once')
+    parser.add_argument('--host-interval', type=float, default=DEFAULT_HOST_INTERVAL, metavar='SECONDS',
+                        help='the least time between the starts of requests to the same host')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, metavar='SECONDS')
+    parser.add_argument('--all', action='store_true', help='check every link, even those not due')
+    parser.add_argument('--origin', help="check against this origin instead of each link's own")
+    parser.add_argument('--cache-file', default=LINK_STATUS_FILE)
+    args = parser.parse_args()
+
+    cache = LinkCache(args.cache_file)
+    urls = report_urls(all_trips())
+    checker = LinkChecker(cache, args.origin, args.concurrency, args.host_interval, args.timeout)
+    start = time.perf_counter()
+    results = checker.check(urls, force=args.all)
+    if checker.outage:
+        print('None of the {} links due could be reached (is the network down?), so nothing was recorded.'.format(
+            sum(1 for url in urls if args.all or cache.is_due(url))))
+    else:
+        print('Checked {} of {} links in {:.2f}s: {}'.format(
+            len(results), len(urls), time.perf_counter() - start,
+            ', '.join('{} {}'.format(n, s) for s, n in sorted(Counter(results.values()).items())) or 'none due'))
+    for url in urls:
+        if cache.status(url) in (DEAD, ERROR):
+            entry = cache.links[url]
+            status = entry['status']
+            if status == DEAD and not cache.is_confirmed_dead(url):
+                status = 'dead (unconfirmed)'
+            print(u'    {}: {} ({})'.format(status, url, entry['message'] or entry['code']))
@@ -1,21 +1,42 @@
 '''
 Utility for creating maps (one per island) that indicate, by region, which
 huts have been visited.
+
+folium (and with it jinja2, branca and requests) is slow to import, so it's
+only imported when the first map is actually built.
+
+For the website, the "Not visited" layers (which start hidden) can be split
+out of the pages into one data file per layer (see layer_shards), which the
+page fetches the first time the layer is enabled. The initial page load then
+only covers the visited huts.
 '''
 
-import folium
+import json
+import re
+from string import Template
 
+from huts import instrument
 from huts.hut import (
     north_island, south_island,
     regions_north, regions_south,
     unknown_place,
 )
 
+_folium = None
+def _import_folium():
+    global _folium
+    if _folium is None:
+        with instrument.stage('map: import folium'):
+            import folium
+        _folium = folium
+    return _folium
+
+
 COOK_STRAIT = 'cook strait' # currently unused but that's ok :)
 CENTER_OF_NORTH_ISLAND = 'center of north island'
 CENTER_OF_SOUTH_ISLAND = 'center of south island'
 
-def _base_map(focus=COOK_STRAIT):
+def _location_and_zoom(focus):
     if focus == COOK_STRAIT:
         MAP_DEFAULT_LOCATION = [-41.4946 , 173.4930]
         ZOOM_START = 5
@@ -27,7 +48,12 @@ def _base_map(focus=COOK_STRAIT):
         ZOOM_START = 6
     else:
         raise ValueError('unknown focus: {}'.format(focus))
+    return MAP_DEFAULT_LOCATION, ZOOM_START
 
+def _base_map(focus=COOK_STRAIT):
+    folium = _import_folium()
+
+    MAP_DEFAULT_LOCATION, ZOOM_START = _location_and_zoom(focus)
     m = folium.Map(
         location=MAP_DEFAULT_LOCATION,
         zoom_start=ZOOM_START,
@@ -55,8 +81,99 @@ COLOR_HUT_NOT_VISITED = 'orange'
 VISITED = 'Visited'
 NOT_VISITED = 'Not visited'
 
+ISLAND_FOCUS = {
+    north_island: CENTER_OF_NORTH_ISLAND,
+    south_island: CENTER_OF_SOUTH_ISLAND,
+}
+
+
+def _island_regions(island):
+    if island == north_island:
+        return regions_north
+    elif island == south_island:
+        return regions_south
+    else:
+        raise ValueError('unrecognized island: {}'.format(island))
+
+
+def layer_name(region, visited):
+    '''e.g. "Canterbury - Visited". The website's overlayadd handler relies
+    on this format.'''
+    return '{} - {}'.format(region, VISITED if visited else NOT_VISITED)
+
+
+LAYER_FILENAME = 'hut_layer.{}.json'
+# matches the (fingerprinted) layer_shards filenames, and their compressed
+# siblings
+LAYER_FILE_PATTERN = r'hut_layer\.[a-z0-9_]+\.[0-9a-f]+\.json(\.gz|\.br)?$'
+
+# Defines load_hut_layer(overlay), which the website's overlayadd handler (see
+# xform_map_for_website.sh) calls with each overlay as it is enabled. Each
+# shard is a JSON array of [lat, lng, popup] rows.
+LAYER_LOADER_TEMPLATE = Template('''
+    var hut_layer_urls = $urls;
+    function load_hut_layer(overlay) {
+        var url = hut_layer_urls[overlay.name];
+        if (!url) {
+            return;
+        }
+        delete hut_layer_urls[overlay.name];
+        $$.getJSON(url, function(rows) {
+            var icon = L.AwesomeMarkers.icon({icon: "$icon", iconColor: "white", markerColor: "$color", prefix: "glyphicon"});
+            rows.forEach(function(h) {
+                L.marker([h[0], h[1]], {icon: icon}).bindPopup(h[2], {maxWidth: 150}).addTo(overlay.layer);
+            });
+        });
+    }
+''')
+
+
+def _js(obj):
+    '''Compact JSON that is safe to embed in a <script>.'''
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).replace('</', '<\\/')
+
+
+def layer_loader_js(layer_urls):
+    '''The script that lazily loads the layers in layer_urls ({layer name:
+    url}).'''
+    return LAYER_LOADER_TEMPLATE.substitute(
+        urls=_js(layer_urls), icon=ICON_HUT, color=COLOR_HUT_NOT_VISITED)
+
+
+def layer_shards(huts_with_trip_data):
+    '''Returns {layer name: (filename, content)}, with one data file for each
+    non-empty "Not visited" layer. Filenames are fingerprinted with the
+    content hash (e.g. hut_layer.wairarapa.<hash>.json), so they can be cached
+    indefinitely.'''
+    from huts.output import fingerprinted
 
-def maps(huts_with_trip_data):
+    rows_by_region = {}
+    for h in huts_with_trip_data:
+        if not h.visited:
+            rows_by_region.setdefault(h.region, []).append(
+                [round(h.lat, 6), round(h.lng, 6), popup_html(h)])
+
+    shards = {}
+    for r, rows in rows_by_region.items():
+        content = json.dumps(rows, ensure_ascii=False, separators=(',', ':'))
+        filename = LAYER_FILENAME.format(re.sub(r'[^a-z0-9]+', '_', r.lower()))
+        shards[layer_name(r, visited=False)] = (fingerprinted(filename, content), content)
+    return shards
+
+
+def popup_html(h):
+    popup_str = h.render_name(html=True)
+    if h.thumbnail_src:
+        # a local copy of the thumbnail (see huts/mirror.py)
+        popup_str = u'<img src="{}" width="150"/> <br/> {}'.format(h.thumbnail_src, popup_str)
+    if h.place != unknown_place:
+        popup_str = u'{} <br/> {}'.format(popup_str, h.place)
+    if h.visited:
+        popup_str = u'{}: <br/> {}'.format(popup_str, h.render_dates_visited(html=True))
+    return popup_str
+
+
+def maps(huts_with_trip_data, layer_urls=None):
     '''Returns a dict with island names for keys and maps for values. The maps
     depict the huts in a bunch of layers - one "visited" layer for every
     region and another "not visited" layer for every region.
@@ -65,11 +182,18 @@ def maps(huts_with_trip_data):
     The "place" will follow the hut name.
     For huts that have been visited, date strings and trip report links will
     follow the place name.
+
+    layer_urls ({layer name: url}, see layer_shards) lists the layers to be
+    loaded on demand: their markers are left out of the maps.
     '''
-    island_maps = {
-        north_island: _base_map(focus=CENTER_OF_NORTH_ISLAND),
-        south_island: _base_map(focus=CENTER_OF_SOUTH_ISLAND),
-    }
+    with instrument.stage('map: build'):
+        return _maps(huts_with_trip_data, layer_urls or {})
+
+
+def _maps(huts_with_trip_data, layer_urls):
+    folium = _import_folium()
+
+    island_maps = {i: _base_map(focus=focus) for i, focus in ISLAND_FOCUS.items()}
 
     regions_to_render = set(list(map(lambda h: h.region, huts_with_trip_data)))
 
@@ -78,20 +202,13 @@ def maps(huts_with_trip_data):
     for i, m in island_maps.items():
         region_groups[i] = {}
 
-        if i == north_island:
-            regions = regions_north
-        elif i == south_island:
-            regions = regions_south
-        else:
-            raise ValueError('unrecognized island: {}'.format(i))
-
-        for r in filter(lambda r: r in regions_to_render, regions):
+        for r in filter(lambda r: r in regions_to_render, _island_regions(i)):
             fg_visited_in_region = folium.FeatureGroup(
-                name='{} - {}'.format(r, VISITED), show=True)
+                name=layer_name(r, visited=True), show=True)
             fg_visited_in_region.add_to(m)
 
             fg_not_visited_in_region = folium.FeatureGroup(
-                name='{} - {}'.format(r, NOT_VISITED), show=False)
+                name=layer_name(r, visited=False), show=False)
             fg_not_visited_in_region.add_to(m)
 
             region_groups[i][r] = {
@@ -100,17 +217,14 @@ def maps(huts_with_trip_data):
             }
 
     for h in huts_with_trip_data:
+        if layer_name(h.region, h.visited) in layer_urls:
+            continue
         if h.visited:
             color = COLOR_HUT_VISITED
         else:
             color = COLOR_HUT_NOT_VISITED
 
-        popup_str = h.render_name(html=True)
-        if h.place != unknown_place:
-            popup_str = u'{} <br/> {}'.format(popup_str, h.place)
-        if h.visited:
-            popup_str = u'{}: <br/> {}'.format(popup_str, h.render_dates_visited(html=True))
-        popup = folium.Popup(popup_str, max_width=150)
+        popup = folium.Popup(popup_html(h), max_width=150)
 
         marker = folium.Marker(
             location=(h.lat, h.lng),
@@ -119,41 +233,57 @@ def maps(huts_with_trip_data):
         )
         group = region_groups[h.island][h.region][VISITED if h.visited else NOT_VISITED]
         marker.add_to(group)
+        instrument.count('markers emitted')
 
     # Layers for everybody!
     for m in island_maps.values():
         folium.LayerControl().add_to(m)
 
+    if layer_urls:
+        for i, m in island_maps.items():
+            island_layer_urls = {
+                layer_name(r, visited=False): layer_urls[layer_name(r, visited=False)]
+                for r in region_groups[i] if layer_name(r, visited=False) in layer_urls
+            }
+            m.get_root().script.add_child(folium.Element(layer_loader_js(island_layer_urls)))
+
+    for m in island_maps.values():
+        _number_elements(m.get_root())
     return island_maps
 
 
+def _number_elements(root):
+    '''Replaces the random ids folium gives its elements (which end up in the
+    page, e.g. as "map_478753b5...") with sequential ones, so that rendering
+    the same huts twice gives the same page, and unchanged pages aren't
+    rewritten (see huts.output).'''
+    from branca.element import Element
+
+    elements = [root]
+    seen = {id(root)}
+    for element in elements:
+        # the children, and elements held as attributes (e.g. a Popup's html,
+        # or a Figure's header and script)
+        related = list(element._children.values()) + [
+            v for k, v in vars(element).items() if k != '_parent' and isinstance(v, Element)]
+        for e in related:
+            if id(e) not in seen:
+                seen.add(id(e))
+                elements.append(e)
+
+    old_names = {id(e): e.get_name() for e in elements}
+    for n, element in enumerate(elements):
+        element._id = '{:032x}'.format(n)
+    # children are keyed by their names (unless added under a fixed name),
+    # and some templates use the keys
+    for element in elements:
+        element._children = type(element._children)(
+            (child.get_name() if key == old_names[id(child)] else key, child)
+            for key, child in element._children.items())
+
+
 if __name__=='__main__':
-    import json
-    import os
-    from huts.hut import BASE_DIR, island_order
-    from huts.merged import (
-            huts_enriched_with_trips,
-            filter_known_region_known_place,
-            by_region_by_place,
-    )
-    from huts.checklist import header, checklist
-    huts = filter_known_region_known_place(huts_enriched_with_trips())
-    island_maps = maps(huts)
-    huts_by_region = by_region_by_place(huts)
-
-    for i in island_order:
-        i_filename = i.lower().replace(' ', '_')
-        map_filename = os.path.join(BASE_DIR, 'rendered_map.{}.html'.format(i_filename))
-        print('Writing map HTML to file: {}'.format(map_filename))
-        with open(map_filename, 'w'):
-            island_maps[i].save(map_filename)
-
-        checklist_filename = os.path.join(BASE_DIR, 'checklist_data.{}.js'.format(i_filename))
-        print('Writing checklist data to file: {}'.format(checklist_filename))
-        with open(checklist_filename, 'w') as f:
-            checklist_data = {"header": header(html=True)}
-            for r, huts_by_place in huts_by_region.items():
-                checklist_data[r] = checklist({r: huts_by_place}, html=True)
-            f.write('var checklist_data = ')
-            f.write(json.dumps(checklist_data))
-            f.write(';')
+    # Writes the map pages and their checklist data (see huts.build; accepts
+    # the same --native, --watch and --profile flags).
+    from huts import build
+    build.main(checklist_page=False)
@@ -2,8 +2,12 @@
 The all-important function: huts_enriched_with_trips(). Merges the data
 from all_huts() with the data from all_trips().
 
+The merging is done by an Enrichment, which can also add, remove and update
+single trips in place (e.g. for watchers and notebooks).
+
 Also exposes some functions for filtering huts:
-    filter_known_region_known_place.
+    filter_known_region_known_place,
+    AttributeIndex (by facilities, bookable, island, region, visited).
 
 Also exposes functions for hierarchically organizing the huts:
     by all (degenerate),
@@ -14,26 +18,167 @@ Also exposes functions for hierarchically organizing the huts:
 
 from collections import defaultdict
 
+from huts import instrument
 from huts.hut import (
-    all_huts,
+    all_huts, Catalog,
     island_order, region_order, place_order, unknown_place,
+    island_rank, region_rank, facility_order, facility_bit,
 )
 from huts.trips import all_trips
 
 
-def huts_enriched_with_trips():
+class Enrichment(object):
+    '''Enrichment state: a list of huts, tagged with the Trip and HutVisit
+    data of the trips added so far.
+
+    add_trip/remove_trip/update_trip only touch the huts visited on that trip
+    (each visit is resolved to a hut id via the Catalog, not scanned for), and
+    keep the per-category rollup counts (see visited_count/total_count) up to
+    date.
+    '''
+
+    def __init__(self, huts):
+        self.huts = huts
+        self.catalog = Catalog(huts)
+        self._total = defaultdict(int)
+        self._visited = defaultdict(int)
+        for h in huts:
+            for c in self._categories(h):
+                self._total[c] += 1
+                if h.visited:
+                    self._visited[c] += 1
+
+        # trip -> the huts it visits, in the order the trips were added
+        self._trips = {}
+        # trip -> its position, which determines the order of each hut's trips
+        self._positions = {}
+        self._next_position = 0
+
+    @staticmethod
+    def _categories(h):
+        return [(), (h.island,), (h.island, h.region), (h.island, h.region, h.place)]
+
+    def visited_count(self, *category):
+        '''e.g. visited_count(north_island, 'Wairarapa') is the number of
+        visited huts in the Wairarapa. No arguments counts all huts.'''
+        return self._visited[category]
+
+    def total_count(self, *category):
+        return self._total[category]
+
+    @property
+    def trips(self):
+        return list(self._trips)
+
+    def _set_visited(self, h, was_visited):
+        if h.visited == was_visited:
+            return
+        delta = 1 if h.visited else -1
+        for c in self._categories(h):
+            self._visited[c] += delta
+
+    def _resolve(self, trip):
+        '''The huts visited on trip. Raises ValueError if a visit doesn't
+        resolve.'''
+        huts = []
+        for hv in trip.hut_visits:
+            h = self.catalog.resolve_visit(hv)
+            if h not in huts:
+                huts.append(h)
+        return huts
+
+    def add_trip(self, trip, position=None):
+        '''Tags the huts visited on trip. The trip's position (defaulting to
+        after all the trips added so far) determines where it goes in each
+        hut's list of trips.'''
+        if trip in self._trips:
+            return
+        # resolve every visit before mutating anything, so a bad trip leaves
+        # the state untouched
+        huts = self._resolve(trip)
+        instrument.count('visits matched', len(trip.hut_visits))
+
+        if position is None:
+            position = self._next_position
+        self._next_position = max(self._next_position, position + 1)
+        self._trips[trip] = huts
+        self._positions[trip] = position
+        for h in huts:
+            was_visited = h.visited
+            h.tag_with_trip(trip)
+            if len(h.trips) > 1 and self._positions[h.trips[-2]] > position:
+                h.trips.sort(key=self._positions.__getitem__)
+            self._set_visited(h, was_visited)
+
+    def remove_trip(self, trip):
+        '''Untags the huts visited on trip.'''
+        for h in self._trips.pop(trip, []):
+            was_visited = h.visited
+            h.untag_trip(trip)
+            self._set_visited(h, was_visited)
+        self._positions.pop(trip, None)
+
+    def update_trip(self, old_trip, new_trip):
+        '''Replaces old_trip with new_trip, in the same position. If
+        new_trip has a visit that doesn't resolve, old_trip is left in place.'''
+        self._resolve(new_trip)
+        position = self._positions.get(old_trip)
+        self.remove_trip(old_trip)
+        self.add_trip(new_trip, position)
+
+    def sync(self, trips):
+        '''Brings the state in line with trips (the complete, ordered list of
+        trips, e.g. freshly reloaded from trips.py): trips are matched up with
+        the ones already added by Trip.key(), then only the trips that are new
+        or gone are added or removed. Returns (number added, number removed).'''
+        current = defaultdict(list)
+        for t in self._trips:
+            current[t.key()].append(t)
+
+        to_add = []
+        kept = []
+        for i, t in enumerate(trips):
+            same = current[t.key()]
+            if same:
+                kept.append((same.pop(0), i))
+            else:
+                to_add.append((i, t))
+        to_remove = [t for ts in current.values() for t in ts]
+
+        # as in add_trip, fail before changing anything
+        for _, t in to_add:
+            self._resolve(t)
+        for t, i in kept:
+            self._positions[t] = i
+        for t in to_remove:
+            self.remove_trip(t)
+        for i, t in to_add:
+            self.add_trip(t, i)
+
+        # the remaining trips keep their relative order unless trips.py was
+        # reordered; if it was, re-sort every hut's trips
+        positions = [self._positions[t] for t in self._trips if t in self._positions]
+        if positions != sorted(positions):
+            self._trips = dict(sorted(self._trips.items(), key=lambda item: self._positions[item[0]]))
+            for h in self.huts:
+                h.trips.sort(key=self._positions.__getitem__)
+
+        return len(to_add), len(to_remove)
+
+
+def huts_enriched_with_trips(huts=None, trips=None):
     '''Returns a list of all huts (open or closed) tagged with
-    the Trip and HutVisit data from trips.py.'''
-    huts = all_huts()
-    for t in all_trips():
-        for hv in t.hut_visits:
-            matches = list(filter(lambda h: h.matches(hv), huts))
-            if len(matches) == 0:
-                raise ValueError("hut doesn't exist: {}".format(hv.name))
-            elif len(matches) > 1:
-                raise ValueError("multiple huts found: {}".format(', '.join(map(str, matches))))
-            [match]  = matches
-            match.tag_with_trip(t)
+    the Trip and HutVisit data from trips.py. Alternative (un-enriched) huts
+    and/or Trips may be passed in instead of all_huts() and all_trips().'''
+    if huts is None:
+        huts = all_huts()
+    if trips is None:
+        from huts.links import hide_dead_links
+        trips = hide_dead_links(all_trips())
+    with instrument.stage('enrich'):
+        enrichment = Enrichment(huts)
+        for t in trips:
+            enrichment.add_trip(t)
     return huts
 
 def by_all(huts):
@@ -76,7 +221,53 @@ def by_island_by_region_by_place(huts):
     return result
 
 def filter_known_region_known_place(huts):
-    return list(filter(lambda h: h.place != unknown_place, huts))
+    '''The huts whose place is known, and whose region is one of
+    region_order (not e.g. unknown_region).'''
+    return list(filter(lambda h: h.place != unknown_place and h.region in region_rank, huts))
+
+class AttributeIndex(object):
+    '''Column arrays of the huts' facilities bitmasks, bookable flags and
+    island/region codes, so that e.g. "unvisited, non-bookable huts with
+    heating in Canterbury" is a few bitwise ops over arrays instead of a scan
+    over the huts. (visited changes as trips are added, so it is checked on
+    the huts that pass the other filters.) Needs numpy.'''
+
+    def __init__(self, huts):
+        import numpy as np
+
+        self.huts = list(huts)
+        n = len(self.huts)
+        # python ints past 64 facilities
+        dtype = np.uint64 if len(facility_order) <= 64 else object
+        self.facilities = np.fromiter((h.facilities for h in self.huts), dtype=dtype, count=n)
+        self.bookable = np.fromiter((h.bookable for h in self.huts), dtype=bool, count=n)
+        self.island_codes = np.fromiter((h.island_code for h in self.huts), dtype=np.int32, count=n)
+        self.region_codes = np.fromiter((h.region_code for h in self.huts), dtype=np.int32, count=n)
+
+    def select(self, facilities=(), bookable=None, island=None, region=None, visited=None):
+        '''Returns the huts that have all the named facilities and match the
+        other criteria (each is ignored when None). region may be a single
+        region name or a collection of region names.'''
+        import numpy as np
+
+        if any(f not in facility_bit for f in facilities):
+            return []
+        mask = sum(facility_bit[f] for f in facilities)
+
+        selected = (self.facilities & self.facilities.dtype.type(mask)) == mask
+        if bookable is not None:
+            selected &= self.bookable == bookable
+        if island is not None:
+            selected &= self.island_codes == island_rank[island]
+        if region is not None:
+            if isinstance(region, str):
+                region = [region]
+            selected &= np.isin(self.region_codes, [region_rank[r] for r in region])
+
+        huts = [self.huts[i] for i in np.flatnonzero(selected)]
+        if visited is not None:
+            huts = [h for h in huts if h.visited == visited]
+        return huts
 
 def summary(huts):
     total = 0
@@ -0,0 +1,329 @@
+'''
+Mirrors the huts' thumbnails (introductionThumbnail in the DOC dataset) and
+pages (staticLink) into a local cache, for offline builds and so the map
+popups can embed the thumbnails (see `huts/build.py --thumbnails`).
+
+The cache (.cache/mirror/ by default) is content-addressed: each response body
+is stored once, as objects/<hash><ext>, and index.json maps each URL to its
+object along with the ETag and Last-Modified the server sent. A URL checked
+less than --max-age hours ago isn't requested again; an older one is
+revalidated with If-None-Match/If-Modified-Since, so an unchanged thumbnail
+costs a 304 and no download. The index is saved every SAVE_EVERY URLs (and
+when the run ends, even if interrupted), so a run that is stopped part way
+resumes where it left off.
+
+Requests are made with urllib.request from a pool of threads (HttpClient),
+which bounds how many are in flight at once, so no dependencies are needed.
+
+--origin fetches every URL from the given origin instead of its own (e.g. a
+local stand-in server, see benchmarks/mirror.py), and only follows redirects
+that stay on it; the cache is still keyed on the original URLs.
+
+Usage:
+    PYTHONPATH=. python3 huts/mirror.py [--concurrency 8] [--max-age 24] [--no-pages]
+                                        [--origin http://127.0.0.1:8000] [--cache-dir DIR]
+'''
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+from urllib.parse import urljoin, urlsplit
+import urllib.request
+
+from huts.hut import BASE_DIR
+from huts.output import atomic_write, content_hash
+
+MIRROR_DIR = os.path.join(BASE_DIR, '.cache', 'mirror')
+INDEX_FILENAME = 'index.json'
+OBJECTS_DIRNAME = 'objects'
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_AGE_HOURS = 24
+DEFAULT_TIMEOUT = 30
+MAX_REDIRECTS = 5
+SAVE_EVERY = 50
+OBJECT_HASH_LENGTH = 16
+
+USER_AGENT = 'huts-mirror/1.0'
+
+EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'text/html': '.html',
+}
+
+
+class MirrorError(Exception):
+    pass
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    # HttpClient follows the redirects itself (see get_following)
+
+    def redirect_request(self, *args):
+        return None
+
+
+class HttpClient(object):
+    '''Makes GET requests with urllib.request, from a pool of `size` threads
+    (so at most `size` requests are in flight at once), with requests to the
+    same host started at least `host_interval` seconds apart. With an
+    `origin`, redirects are only followed to URLs on it.'''
+
+    def __init__(self, size=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, host_interval=0, origin=None):
+        self.size = size
+        self.timeout = timeout
+        self.host_interval = host_interval
+        self.origin = urlsplit(origin)[:2] if origin else None
+        self._opener = urllib.request.build_opener(_NoRedirects)
+        self._executor = ThreadPoolExecutor(size)
+        self._lock = threading.Lock()
+        # host -> the earliest time (on the monotonic clock) the next request
+        # to it may start
+        self._next_start = {}
+
+    def _wait_turn(self, host):
+        if not self.host_interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self.host_interval
+        time.sleep(start - now)
+
+    def submit(self, url, headers=None):
+        '''Starts get_following(url, headers) in the pool. Returns its
+        Future.'''
+        return self._executor.submit(self.get_following, url, headers)
+
+    def get_following(self, url, headers=None):
+        '''Like get, but follows redirects. Returns (final url, status,
+        headers, body).'''
+        for _ in range(MAX_REDIRECTS + 1):
+            status, response_headers, body = self.get(url, headers)
+            if status in (301, 302, 303, 307, 308) and 'location' in response_headers:
+                url = urljoin(url, response_headers['location'])
+                if self.origin and urlsplit(url)[:2] != self.origin:
+                    raise MirrorError('redirected off the origin, to {}'.format(url))
+                continue
+            return url, status, response_headers, body
+        raise MirrorError('too many redirects')
+
+    def get(self, url, headers=None):
+        '''Returns (status, headers, body). Response header names are
+        lowercased. Network errors are raised as the OSError urllib wraps in
+        a URLError (e.g. a socket.gaierror).'''
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise MirrorError('unsupported URL: {}'.format(url))
+        request = urllib.request.Request(url, headers=dict(
+            {'User-Agent': USER_AGENT, 'Accept-Encoding': 'identity'}, **(headers or {})))
+
+        self._wait_turn(parts.hostname)
+        try:
+            response = self._opener.open(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            # any status but 2xx, including redirects and 304s
+            response = e
+        except urllib.error.URLError as e:
+            if isinstance(e.reason, OSError):
+                raise e.reason
+            raise MirrorError(str(e.reason))
+        with response:
+            return response.status, {k.lower(): v for k, v in response.headers.items()}, response.read()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class MirrorStats(object):
+    '''What a mirror run did, for the throughput report.'''
+
+    def __init__(self):
+        self.fetched = 0
+        self.not_modified = 0
+        self.fresh = 0
+        self.failed = [] # [(url, message)]
+        self.bytes = 0
+        self.threads = 0
+        self.seconds = 0.0
+
+    def requested(self):
+        return self.fetched + self.not_modified + len(self.failed)
+
+    def report(self, f=sys.stdout):
+        seconds = max(self.seconds, 1e-9)
+        f.write('Mirrored {} URLs in {:.2f}s ({:.1f} requests/s from {} threads)\n'.format(
+            self.requested() + self.fresh, self.seconds, self.requested() / seconds, self.threads))
+        f.write('    {} fetched ({:.1f} KB, {:.1f} KB/s), {} not modified, {} fresh (not requested), {} failed\n'.format(
+            self.fetched, self.bytes / 1024, self.bytes / 1024 / seconds,
+            self.not_modified, self.fresh, len(self.failed)))
+        for url, message in self.failed:
+            f.write(u'    failed: {}: {}\n'.format(url, message))
+
+
+class Mirror(object):
+    '''The on-disk cache of mirrored URLs (see the module docstring).'''
+
+    def __init__(self, cache_dir=MIRROR_DIR, origin=None):
+        self.cache_dir = cache_dir
+        self.origin = origin
+        self.index_path = os.path.join(cache_dir, INDEX_FILENAME)
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.index = {}
+
+    def object_path(self, name):
+        return os.path.join(self.cache_dir, OBJECTS_DIRNAME, name)
+
+    def cached(self, url):
+        '''The name of the object holding url's content, or None if it hasn't
+        been mirrored.'''
+        entry = self.index.get(url)
+        if entry is None or not os.path.exists(self.object_path(entry['object'])):
+            return None
+        return entry['object']
+
+    def read(self, url):
+        with open(self.object_path(self.cached(url)), 'rb') as f:
+            return f.read()
+
+    def save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        atomic_write(self.index_path, json.dumps(self.index, indent=1, sort_keys=True))
+
+    def _store(self, url, content_type, body):
+        ext = EXTENSIONS.get(content_type.split(';')[0].strip().lower())
+        if ext is None:
+            ext = os.path.splitext(urlsplit(url).path)[1].lower()
+        name = content_hash(body)[:OBJECT_HASH_LENGTH] + ext
+        path = self.object_path(name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, body)
+        return name
+
+    def _fetch_url(self, url):
+        if not self.origin:
+            return url
+        parts = urlsplit(url)
+        return self.origin.rstrip('/') + parts.path + ('?' + parts.query if parts.query else '')
+
+    def _conditional_headers(self, url):
+        headers = {}
+        entry = self.index.get(url) if self.cached(url) else None
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _record(self, url, response, stats):
+        location, status, response_headers, body = response
+        if status == 304 and self.cached(url):
+            self.index[url]['checked'] = time.time()
+            stats.not_modified += 1
+        elif status == 200:
+            self.index[url] = {
+                'object': self._store(location, response_headers.get('content-type', ''), body),
+                'etag': response_headers.get('etag'),
+                'last_modified': response_headers.get('last-modified'),
+                'checked': time.time(),
+            }
+            stats.fetched += 1
+            stats.bytes += len(body)
+        else:
+            raise MirrorError('HTTP {}'.format(status))
+
+    def mirror(self, urls, concurrency=DEFAULT_CONCURRENCY, max_age_hours=DEFAULT_MAX_AGE_HOURS,
+               timeout=DEFAULT_TIMEOUT):
+        '''Mirrors urls (duplicates and Nones are skipped). Returns a
+        MirrorStats.'''
+        stats = MirrorStats()
+        start = time.perf_counter()
+        cutoff = time.time() - max_age_hours * 3600
+        todo = []
+        for url in dict.fromkeys(u for u in urls if u):
+            if self.cached(url) and self.index[url]['checked'] > cutoff:
+                stats.fresh += 1
+            else:
+                todo.append(url)
+
+        client = HttpClient(concurrency, timeout, origin=self.origin)
+        try:
+            # the requests run in the client's threads; the responses are
+            # stored (and the index updated) here, as they complete
+            futures = {client.submit(self._fetch_url(url), self._conditional_headers(url)): url
+                       for url in todo}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    self._record(url, future.result(), stats)
+                except (OSError, http.client.HTTPException, MirrorError, ValueError) as e:
+                    stats.failed.append((url, str(e) or type(e).__name__))
+                if stats.requested() % SAVE_EVERY == 0:
+                    self.save()
+        finally:
+            client.close()
+            self.save()
+            stats.threads = client.size
+            stats.seconds = time.perf_counter() - start
+        return stats
+
+
+def urls(huts, thumbnails=True, pages=True):
+    '''The URLs to mirror for huts.'''
+    result = []
+    for h in huts:
+        if thumbnails and h.thumbnail:
+            result.append(h.thumbnail)
+        if pages and h.url:
+            result.append(h.url)
+    return result
+
+
+def attach_thumbnails(huts, mirror, prefix):
+    '''Sets thumbnail_src of each hut whose thumbnail has been mirrored to
+    prefix + the name of its object (see Mirror.cached). Returns
+    {object name: thumbnail url}.'''
+    objects = {}
+    for h in huts:
+        name = mirror.cached(h.thumbnail) if h.thumbnail else None
+        h.thumbnail_src = prefix + name if name else None
+        if name:
+            objects[name] = h.thumbnail
+    return objects
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from huts.hut import all_huts
+
+    parser = argparse.ArgumentParser(description="Mirror the huts' thumbnails and pages.")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='the most requests in flight at once')
+    parser.add_argument('--max-age', type=float, default=DEFAULT_MAX_AGE_HOURS, metavar='HOURS',
+                        help="don't request URLs checked less than this long ago")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, metavar='SECONDS')
+    parser.add_argument('--no-pages', action='store_true', help='only mirror the thumbnails')
+    parser.add_argument('--origin', help="fetch from this origin instead of each URL's own")
+    parser.add_argument('--cache-dir', default=MIRROR_DIR)
+    args = parser.parse_args()
+
+    m = Mirror(args.cache_dir, origin=args.origin)
+    stats = m.mirror(urls(all_huts(), pages=not args.no_pages),
+                     args.concurrency, args.max_age, args.timeout)
+    stats.report()
+    if stats.failed:
+        sys.exit(1)
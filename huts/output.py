@@ -0,0 +1,186 @@
+'''
+Content-addressed output files.
+
+write_if_changed() writes a file only if its content differs from what's on
+disk, and then atomically (to a temporary file in the same directory, renamed
+over the original), so that a file's mtime only changes when its content does
+and readers never see a half-written file.
+
+OutputDir does the same for a directory of outputs, remembering the hash of
+each file it has written (so unchanged outputs of a warm build aren't even
+read back), and keeps a manifest of the content hashes, e.g. for cache-busting
+file names:
+
+    {
+      "rendered_checklist.html": {"sha256": "3f1c...", "bytes": 140977},
+      ...
+    }
+
+For static hosting, OutputDir.write can also write pre-compressed siblings of
+a file (file.gz, and file.br if the optional brotli package is installed), and
+fingerprinted() gives the cache-busting name for a file's content.
+'''
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from huts import instrument
+
+MANIFEST_FILENAME = 'rendered_manifest.json'
+
+FINGERPRINT_LENGTH = 12
+
+
+def _bytes(content):
+    if isinstance(content, str):
+        return content.encode('utf-8')
+    return content
+
+
+def content_hash(content):
+    '''The hex SHA-256 of content (str, encoded as UTF-8, or bytes).'''
+    return hashlib.sha256(_bytes(content)).hexdigest()
+
+
+def fingerprinted(filename, content):
+    '''e.g. fingerprinted('data.js', content) is 'data.<hash>.js', where
+    <hash> is the start of content_hash(content).'''
+    stem, ext = os.path.splitext(filename)
+    return '{}.{}{}'.format(stem, content_hash(content)[:FINGERPRINT_LENGTH], ext)
+
+
+def fingerprint_pattern(filename):
+    '''A regex matching every fingerprinted(filename, ...) name (and its
+    compressed siblings).'''
+    stem, ext = os.path.splitext(filename)
+    return re.compile(r'{}\.[0-9a-f]{{{}}}{}(\.gz|\.br)?$'.format(
+        re.escape(stem), FINGERPRINT_LENGTH, re.escape(ext)))
+
+
+def compressed(content):
+    '''Returns [(suffix, compressed bytes)] for each available encoding. The
+    output is deterministic (e.g. no timestamp in the gzip header), so
+    unchanged content compresses to unchanged files.'''
+    data = _bytes(content)
+    result = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        result.append(('.br', brotli.compress(data)))
+    return result
+
+
+def file_hash(path):
+    '''The hex SHA-256 of the file at path, or None if there is no such
+    file.'''
+    h = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                h.update(block)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+
+def atomic_write(path, content):
+    '''Writes content to path via a temporary file and a rename.'''
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_bytes(content))
+        # mkstemp creates the file as 0600; give it the usual permissions
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_if_changed(path, content):
+    '''Writes content to path, unless the file already has exactly that
+    content. Returns whether the file was written.'''
+    if file_hash(path) == content_hash(content):
+        return False
+    atomic_write(path, content)
+    return True
+
+
+class OutputDir(object):
+    '''A directory of content-addressed outputs, with a manifest.'''
+
+    def __init__(self, out_dir, manifest_filename=MANIFEST_FILENAME):
+        self.out_dir = out_dir
+        self.manifest_path = os.path.join(out_dir, manifest_filename)
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.manifest = {}
+        # filename -> hash of what this OutputDir last wrote (or found) there
+        self._hashes = {}
+
+    def path(self, filename):
+        return os.path.join(self.out_dir, filename)
+
+    def write(self, filename, content, precompress=False):
+        '''Writes content to out_dir/filename if it has changed, and records
+        its hash in the manifest. With precompress, also writes its compressed
+        siblings (see compressed()). Returns whether the file was written.'''
+        written = self._write(filename, content)
+        if precompress and (written or not self._has_compressed(filename)):
+            with instrument.stage('output: compress'):
+                variants = compressed(content)
+            for suffix, data in variants:
+                self._write(filename + suffix, data, manifest=False)
+        return written
+
+    def _has_compressed(self, filename):
+        suffixes = ['.gz'] + (['.br'] if brotli is not None else [])
+        return all(os.path.exists(self.path(filename + s)) for s in suffixes)
+
+    def _write(self, filename, content, manifest=True):
+        path = self.path(filename)
+        digest = content_hash(content)
+        if manifest:
+            self.manifest[filename] = {'sha256': digest, 'bytes': len(_bytes(content))}
+
+        if self._hashes.get(filename) == digest and os.path.exists(path):
+            return False
+        self._hashes[filename] = digest
+        if file_hash(path) == digest:
+            instrument.count('outputs unchanged')
+            return False
+
+        with instrument.stage('output: write'):
+            atomic_write(path, content)
+        instrument.count_bytes_written(path)
+        return True
+
+    def prune(self, pattern, keep):
+        '''Removes the files in out_dir whose names match the regex pattern,
+        except those in keep. Returns the filenames removed.'''
+        removed = []
+        for filename in sorted(os.listdir(self.out_dir)):
+            if re.match(pattern, filename) and filename not in keep:
+                os.remove(self.path(filename))
+                self.manifest.pop(filename, None)
+                self._hashes.pop(filename, None)
+                removed.append(filename)
+        return removed
+
+    def write_manifest(self):
+        '''Writes the manifest (if it has changed). Returns whether it was
+        written.'''
+        content = json.dumps(self.manifest, indent=2, sort_keys=True) + '\n'
+        return write_if_changed(self.manifest_path, content)
@@ -0,0 +1,125 @@
+'''
+Publishes the built artifacts (see huts/build.py) to the website, ready for
+a static server:
+  - <island>_matt_map.html, the map pages (transformed by
+    xform_map_for_website.sh),
+  - <island>_matt_data.<hash>.js, the checklist data for each map page, under
+    a fingerprinted name (so it can be served with long-lived cache headers),
+    which the map page's <script src=...> points at,
+  - hut_layer.<region>.<hash>.json, the layers the map pages load on demand,
+  - matt_checklist.html, the checklist page,
+  - thumbs/<hash>.<ext>, the thumbnails the map popups embed (if built with
+    --thumbnails).
+
+Everything but the thumbnails is minified, and has pre-compressed .gz (and,
+if the brotli package is installed, .br) siblings. As with huts/build.py, files are only
+rewritten when their content changes. Superseded fingerprinted files are
+removed, and huts_manifest.json maps each published name to its content hash.
+
+Usage:
+    PYTHONPATH=. python3 huts/publish.py ../website/tramping
+'''
+
+import os
+import re
+import subprocess
+import sys
+
+from huts.hut import BASE_DIR, island_order
+from huts.build import (
+    CHECKLIST_FILENAME, MAP_FILENAME, CHECKLIST_DATA_FILENAME, THUMBNAILS_DIRNAME, _island_filename,
+)
+from huts.map import LAYER_FILE_PATTERN
+from huts.output import OutputDir, fingerprinted, fingerprint_pattern
+
+PUBLISHED_CHECKLIST_FILENAME = 'matt_checklist.html'
+PUBLISHED_MAP_FILENAME = '{}_matt_map.html'
+PUBLISHED_DATA_FILENAME = '{}_matt_data.js'
+MANIFEST_FILENAME = 'huts_manifest.json'
+
+XFORM_SCRIPT = os.path.join(BASE_DIR, 'xform_map_for_website.sh')
+
+_leading_whitespace = re.compile(r'^[ \t]+', re.MULTILINE)
+_blank_lines = re.compile(r'\n{2,}')
+# the layer_shards filenames referenced by a map page
+_layer_re = re.compile(r'"(hut_layer\.[a-z0-9_]+\.[0-9a-f]+\.json)"')
+# the thumbnails referenced by a map page or layer (see Builder._write_thumbnails)
+_thumbnail_re = re.compile(r'{}/[0-9a-f]+\.[a-z]+'.format(THUMBNAILS_DIRNAME))
+
+
+def minify_html(html):
+    '''Removes indentation and blank lines. Lines are kept, so inline scripts
+    (which may contain // comments or rely on automatic semicolon insertion)
+    are unaffected.'''
+    return _blank_lines.sub('\n', _leading_whitespace.sub('', html)).lstrip('\n')
+
+
+def _read(filename, mode='r'):
+    with open(os.path.join(BASE_DIR, filename), mode) as f:
+        return f.read()
+
+
+def _xform_map(map_filename, js_file):
+    return subprocess.run(
+        [XFORM_SCRIPT, os.path.join(BASE_DIR, map_filename), js_file],
+        stdout=subprocess.PIPE, check=True,
+    ).stdout.decode('utf-8')
+
+
+def publish(dest_dir):
+    '''Publishes the artifacts to dest_dir (created if need be). Returns the
+    filenames written.'''
+    os.makedirs(dest_dir, exist_ok=True)
+    outputs = OutputDir(dest_dir, MANIFEST_FILENAME)
+    written = []
+
+    def write(filename, content, precompress=True):
+        if outputs.write(filename, content, precompress=precompress):
+            print('Wrote file: {}'.format(outputs.path(filename)))
+            written.append(filename)
+
+    def prune(pattern, *filenames):
+        keep = [f + suffix for f in filenames for suffix in ('', '.gz', '.br')]
+        for f in outputs.prune(pattern, keep):
+            print('Removed file: {}'.format(outputs.path(f)))
+
+    layers = set()
+    thumbnails = set()
+    for i in island_order:
+        data_filename = PUBLISHED_DATA_FILENAME.format(_island_filename(i))
+        data = _read(CHECKLIST_DATA_FILENAME.format(_island_filename(i)))
+        data_fingerprinted = fingerprinted(data_filename, data)
+        write(data_fingerprinted, data)
+        outputs.manifest[data_filename] = outputs.manifest.pop(data_fingerprinted)
+        outputs.manifest[data_filename]['name'] = data_fingerprinted
+
+        prune(fingerprint_pattern(data_filename), data_fingerprinted)
+
+        map_filename = MAP_FILENAME.format(_island_filename(i))
+        html = _xform_map(map_filename, data_fingerprinted)
+        write(PUBLISHED_MAP_FILENAME.format(_island_filename(i)), minify_html(html))
+        layers.update(_layer_re.findall(html))
+        thumbnails.update(_thumbnail_re.findall(html))
+
+    for filename in sorted(layers):
+        content = _read(filename)
+        write(filename, content)
+        thumbnails.update(_thumbnail_re.findall(content))
+    prune(LAYER_FILE_PATTERN, *layers)
+
+    if thumbnails:
+        os.makedirs(outputs.path(THUMBNAILS_DIRNAME), exist_ok=True)
+    for filename in sorted(thumbnails):
+        # already compressed
+        write(filename, _read(filename, 'rb'), precompress=False)
+
+    write(PUBLISHED_CHECKLIST_FILENAME, minify_html(_read(CHECKLIST_FILENAME)))
+
+    outputs.write_manifest()
+    return written
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit('Usage: {} DEST_DIR'.format(sys.argv[0]))
+    publish(sys.argv[1])
@@ -0,0 +1,183 @@
+'''
+A small query API over a list of (enriched) huts:
+
+    from huts.query import Query
+    q = Query(huts_enriched_with_trips())
+    nearby = q(island=north_island, visited=False, within_km=((-41.29, 174.78), 20),
+               facilities=['Heating'])
+    checklist(by_island_by_region_by_place(nearby))
+    print(nearby.explain())
+
+Criteria (all of which must hold):
+    island, region, place, name       equal to the given value
+    island__in, region__in, place__in, name__in
+                                      one of the given values
+    visited, sleep, bookable, doc_maintained
+                                      the flag is True/False
+    facilities                        has all the named facilities
+    within_km=((lat, lng), km)        no further than km from the point
+
+Query builds its indexes once: huts by island/region/place code and by name,
+and a spatial grid. Each query is compiled into a plan: the candidates come
+from the most selective index that applies (or, failing that, a scan), and
+the rest of the criteria are checked on the candidates. visited and sleep
+change as trips are added (see huts.merged.Enrichment), so they are always
+read from the huts themselves. Results are lazy, and can be iterated any
+number of times (e.g. by huts.map.maps, which makes two passes).
+'''
+
+from collections import defaultdict
+import math
+
+from huts.geo import distance_km
+from huts.hut import island_rank, region_rank, place_codes, facility_bit
+
+# size (in degrees) of the cells of the spatial grid
+GRID_CELL_DEGREES = 0.1
+KM_PER_DEGREE_LAT = 111.32
+
+_CODED = {
+    'island': ('island_code', island_rank),
+    'region': ('region_code', region_rank),
+    'place': ('place_code', place_codes),
+}
+_FLAGS = ['visited', 'sleep', 'bookable', 'doc_maintained']
+
+
+def _cell(lat, lng):
+    return (int(math.floor(lat / GRID_CELL_DEGREES)), int(math.floor(lng / GRID_CELL_DEGREES)))
+
+
+class Query(object):
+    '''Indexes huts for querying. Calling it returns a QueryResult.'''
+
+    def __init__(self, huts):
+        self.huts = list(huts)
+        self._by_code = {field: defaultdict(list) for field in _CODED}
+        self._by_name = defaultdict(list)
+        self._grid = defaultdict(list)
+        for i, h in enumerate(self.huts):
+            for field, (attr, _) in _CODED.items():
+                self._by_code[field][getattr(h, attr)].append(i)
+            self._by_name[h.name].append(i)
+            self._grid[_cell(h.lat, h.lng)].append(i)
+
+    def __call__(self, **criteria):
+        return QueryResult(self, _compile(self, criteria))
+
+    def _positions(self, field, values):
+        '''The positions of the huts whose field is one of values, in
+        catalog order.'''
+        if field == 'name':
+            index = self._by_name
+            keys = values
+        else:
+            _, codes = _CODED[field]
+            index = self._by_code[field]
+            keys = [codes[v] for v in values if v in codes]
+        result = []
+        for k in keys:
+            result.extend(index.get(k, []))
+        return sorted(set(result))
+
+    def _positions_near(self, lat, lng, km):
+        '''The positions of the huts in the grid cells that overlap the
+        bounding box of the circle, in catalog order.'''
+        d_lat = km / KM_PER_DEGREE_LAT
+        d_lng = km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 1e-6))
+        min_cell = _cell(lat - d_lat, lng - d_lng)
+        max_cell = _cell(lat + d_lat, lng + d_lng)
+        result = []
+        for cell_lat in range(min_cell[0], max_cell[0] + 1):
+            for cell_lng in range(min_cell[1], max_cell[1] + 1):
+                result.extend(self._grid.get((cell_lat, cell_lng), []))
+        return sorted(result)
+
+
+class Plan(object):
+    '''How a query is run: where the candidates come from (an index lookup,
+    or a scan), and the checks applied to each candidate.'''
+
+    def __init__(self, source, candidates, checks):
+        self.source = source
+        self.candidates = candidates # positions, or None to scan
+        self.checks = checks # [(description, predicate)]
+
+    def __str__(self):
+        lines = [self.source]
+        lines.extend('  filter: {}'.format(description) for description, _ in self.checks)
+        return '\n'.join(lines)
+
+
+def _compile(query, criteria):
+    # (criterion, description, positions, whether the positions are exactly
+    # the huts that meet the criterion)
+    sources = []
+    # (criterion, description, predicate)
+    checks = []
+
+    for key, value in criteria.items():
+        field, _, op = key.partition('__')
+        if field in _CODED or field == 'name':
+            if op == 'in':
+                values = set(value)
+            elif op == '':
+                values = {value}
+            else:
+                raise TypeError('unsupported lookup: {}'.format(key))
+            description = '{} in {}'.format(field, sorted(values))
+            sources.append((key, 'index: ' + description, query._positions(field, values), True))
+            checks.append((key, description, lambda h, field=field, values=values: getattr(h, field) in values))
+        elif key in _FLAGS:
+            checks.append((key, '{} is {}'.format(key, bool(value)),
+                           lambda h, key=key, value=bool(value): getattr(h, key) == value))
+        elif key == 'facilities':
+            if any(f not in facility_bit for f in value):
+                sources.append((key, 'unknown facilities: {}'.format(list(value)), [], True))
+                continue
+            mask = sum(facility_bit[f] for f in value)
+            checks.append((key, 'facilities & {:#x}'.format(mask), lambda h, mask=mask: h.has_facilities(mask)))
+        elif key == 'within_km':
+            (lat, lng), km = value
+            sources.append((key, 'grid: within {} km of ({}, {})'.format(km, lat, lng),
+                            query._positions_near(lat, lng, km), False))
+            checks.append((key, 'distance <= {} km'.format(km),
+                           lambda h, point=[lng, lat], km=km: distance_km([h.lng, h.lat], point) <= km))
+        else:
+            raise TypeError('unsupported criterion: {}'.format(key))
+
+    if not sources:
+        return Plan('scan: {} huts'.format(len(query.huts)), None,
+                    [(description, predicate) for _, description, predicate in checks])
+
+    # the candidates come from the most selective index, and its criterion
+    # needn't be checked again (unless the index is approximate, like the grid)
+    key, description, positions, exact = min(sources, key=lambda source: len(source[2]))
+    checks = [(d, predicate) for k, d, predicate in checks if not (exact and k == key)]
+    return Plan('{} ({} candidates)'.format(description, len(positions)), positions, checks)
+
+
+class QueryResult(object):
+    '''The lazily evaluated result of a query. Iterating runs the plan
+    afresh, so the result reflects the current visited/sleep flags.'''
+
+    def __init__(self, query, plan):
+        self.query = query
+        self.plan = plan
+
+    def __iter__(self):
+        huts = self.query.huts
+        if self.plan.candidates is None:
+            candidates = huts
+        else:
+            candidates = (huts[i] for i in self.plan.candidates)
+        predicates = [predicate for _, predicate in self.plan.checks]
+        for h in candidates:
+            if all(p(h) for p in predicates):
+                yield h
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def explain(self):
+        return str(self.plan)
@@ -0,0 +1,361 @@
+'''
+The sources the hut catalog is federated from, and the federation itself.
+
+A source is anything with a name (recorded as each hut's provenance) and a
+huts() method returning Huts:
+  - DocSource, the DOC huts export (data/DOC_Huts.geojson), with the overrides
+    and polygon lookups applied (see huts.hut),
+  - JSONListSource, a hand-maintained JSON list in the format of
+    data/non_DOC_Huts.json,
+  - GeoJSONSource and CSVSource, other exports (e.g. club or private huts).
+    Their fields default to the names used in non_DOC_Huts.json, and can be
+    renamed with `fields`. A record without a name or coordinates is an
+    error (a ValueError naming the source and the record). Huts without a
+    region get one from data/regions.geojson if it's present, or else are in
+    unknown_region; huts without an island get one from data/islands.geojson;
+    and huts without a place are in unknown_place. (Huts in unknown_region or
+    unknown_place are left out of the checklist and maps, see
+    huts.merged.filter_known_region_known_place.)
+
+More sources can be listed in data/sources.json (optional), e.g.
+    [
+        {"type": "csv", "name": "club", "path": "data/club_huts.csv",
+         "fields": {"name": "Hut", "url": "Website"}},
+        {"type": "geojson", "name": "private", "path": "data/private_huts.geojson"}
+    ]
+with paths relative to the repo.
+
+federate() merges the sources in order. A hut that is within
+DUPLICATE_DISTANCE_KM of a hut from an earlier source, with a similar name
+(see similar_names), is taken to be the same hut: it's dropped, and recorded
+in the provenance of the hut it duplicates (whose other names then resolve to
+it too, see huts.hut.Catalog). Candidates are found through a spatial grid of
+cells about DUPLICATE_DISTANCE_KM across, so each hut is only compared with
+the huts in the cells around it rather than with every other hut.
+
+Every hut's provenance is a list of [source name, id in that source, name]
+entries: first its own record, then those of its duplicates. Huts from the
+extra sources get a stable id derived from the source name and their id in
+the source (or, failing that, their name and position).
+
+Usage:
+    PYTHONPATH=. python3 huts/sources.py
+prints each source's hut count and the duplicates found.
+'''
+
+import csv
+from difflib import SequenceMatcher
+import hashlib
+import json
+import math
+import os
+import re
+import unicodedata
+
+from huts import instrument
+from huts.hut import (
+    BASE_DIR, DOC_HUTS_FILE, NON_DOC_HUTS_FILE, DOC_SOURCE, NON_DOC_SOURCE,
+    Hut, unknown_place, unknown_region, facility_mask, parse_facilities, _doc_huts, _non_doc_huts,
+)
+
+SOURCES_FILE = os.path.join(BASE_DIR, 'data', 'sources.json')
+
+DUPLICATE_DISTANCE_KM = 1.0
+NAME_SIMILARITY = 0.8
+KM_PER_DEGREE_LAT = 111.32
+# the most southerly huts are at about 47 degrees south, where a degree of
+# longitude is shortest; cells sized for that latitude are big enough
+# everywhere in New Zealand
+MIN_COS_LAT = math.cos(math.radians(48))
+
+# words that say what kind of hut it is rather than which hut it is
+GENERIC_WORDS = {'hut', 'huts', 'bivvy', 'bivouac', 'biv', 'shelter', 'lodge', 'cottage', 'the', 'historic'}
+
+DEFAULT_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'place': 'place',
+    'region': 'region',
+    'island': 'island',
+    'lng': 'lng',
+    'lat': 'lat',
+    'url': 'staticLink',
+    'thumbnail': 'introductionThumbnail',
+    'facilities': 'facilities',
+    'bookable': 'bookable',
+}
+
+
+class DocSource(object):
+    name = DOC_SOURCE
+
+    def __init__(self, path=DOC_HUTS_FILE):
+        self.path = path
+
+    def huts(self):
+        return _doc_huts(self.path)
+
+
+class JSONListSource(object):
+    name = NON_DOC_SOURCE
+
+    def __init__(self, path=NON_DOC_HUTS_FILE):
+        self.path = path
+
+    def huts(self):
+        return _non_doc_huts(self.path)
+
+
+def _stable_id(source_name, source_id):
+    '''A stable id, in a range DOC's assetIds and the hand-maintained ids
+    don't reach.'''
+    digest = hashlib.sha256('{}:{}'.format(source_name, source_id).encode('utf-8')).hexdigest()
+    return (1 << 48) | int(digest[:12], 16)
+
+
+class _RecordSource(object):
+    '''A source of flat records (dicts), with fields named as in `fields`.'''
+
+    def __init__(self, path, name, fields=None):
+        self.path = path
+        self.name = name
+        self.fields = dict(DEFAULT_FIELDS, **(fields or {}))
+
+    def _hut(self, record):
+        def get(field, default=None):
+            value = record.get(self.fields[field])
+            return default if value in (None, '') else value
+
+        missing = [field for field in ['name', 'lng', 'lat'] if get(field) is None]
+        if missing:
+            raise ValueError(u'{} ({}): record without {}: {}'.format(
+                self.name, self.path, ', '.join(self.fields[field] for field in missing), record))
+
+        h = Hut()
+        h.name = get('name').strip()
+        h.lng = float(get('lng'))
+        h.lat = float(get('lat'))
+        source_id = get('id', '{}@{:.5f},{:.5f}'.format(h.name, h.lat, h.lng))
+        h.id = _stable_id(self.name, source_id)
+        h.global_id = None
+        h.place = get('place', unknown_place)
+        h.region = get('region')
+        h.island = get('island')
+        h.url = get('url')
+        h.thumbnail = get('thumbnail')
+        h.thumbnail_src = None
+        facilities = get('facilities', [])
+        if isinstance(facilities, str):
+            facilities = parse_facilities(facilities)
+        h.facilities = facility_mask(facilities)
+        h.bookable = get('bookable', False) in (True, 'Yes', 'yes', 'true', '1')
+        h.doc_maintained = False
+        h.provenance = [[self.name, source_id, h.name]]
+        h.reset_visits()
+        return h
+
+    def huts(self):
+        huts = [self._hut(record) for record in self.records()]
+        _assign_regions_and_islands(huts)
+        instrument.count('huts loaded', len(huts))
+        return huts
+
+
+class GeoJSONSource(_RecordSource):
+    '''A GeoJSON FeatureCollection of Points.'''
+
+    def records(self):
+        with open(self.path) as f:
+            features = json.load(f)['features']
+        for feature in features:
+            record = dict(feature['properties'])
+            lng, lat = feature['geometry']['coordinates'][:2]
+            record[self.fields['lng']] = lng
+            record[self.fields['lat']] = lat
+            yield record
+
+
+class CSVSource(_RecordSource):
+    '''A CSV file with a header row. Facilities are comma separated, as in the
+    DOC export.'''
+
+    def records(self):
+        with open(self.path, newline='') as f:
+            yield from csv.DictReader(f)
+
+
+SOURCE_TYPES = {'doc': DocSource, 'json': JSONListSource, 'geojson': GeoJSONSource, 'csv': CSVSource}
+
+
+def _assign_regions_and_islands(huts):
+    from huts import geo
+    from huts.hut import _lookup_island
+
+    missing = [h for h in huts if not h.region]
+    if missing and os.path.exists(geo.REGIONS_FILE):
+        regions = geo.locate(geo.REGIONS_FILE, {h.id: (h.lng, h.lat) for h in missing})
+        for h in missing:
+            h.region = regions[h.id]
+
+    missing = [h for h in huts if not h.island]
+    islands = geo.locate(geo.ISLANDS_FILE, {h.id: (h.lng, h.lat) for h in missing})
+    for h in missing:
+        h.island = islands[h.id] or _lookup_island(h.region, h.lat)
+
+    for h in huts:
+        if not h.region:
+            h.region = unknown_region
+
+
+def extra_sources(sources_file=SOURCES_FILE):
+    '''The sources listed in sources_file, if it exists.'''
+    if not os.path.exists(sources_file):
+        return []
+    with open(sources_file) as f:
+        config = json.load(f)
+    sources = []
+    for entry in config:
+        entry = dict(entry)
+        cls = SOURCE_TYPES[entry.pop('type')]
+        entry['path'] = os.path.join(BASE_DIR, entry['path'])
+        sources.append(cls(**entry))
+    return sources
+
+
+def default_sources(doc_huts_file=DOC_HUTS_FILE, non_doc_huts_file=NON_DOC_HUTS_FILE):
+    return [DocSource(doc_huts_file), JSONListSource(non_doc_huts_file)] + extra_sources()
+
+
+def normalize_name(name):
+    '''e.g. "Ōtamahua Hut (historic)" -> "otamahua".'''
+    name = name.lower()
+    if not name.isascii():
+        name = unicodedata.normalize('NFKD', name)
+        name = ''.join(c for c in name if not unicodedata.combining(c))
+    words = re.findall(r'[a-z0-9]+', name)
+    return ' '.join(w for w in words if w not in GENERIC_WORDS)
+
+
+class _NameMatcher(object):
+    '''Compares one (normalized) name with others. SequenceMatcher does its
+    preprocessing on its second sequence, so that's the name held here.'''
+
+    def __init__(self, name):
+        self.name = name
+        self._matcher = None
+
+    def similar(self, other):
+        '''Whether the names are close enough to be the same hut, given that
+        the huts are close together.'''
+        a, b = other, self.name
+        if a == b:
+            return True
+        if not a or not b:
+            return False
+        # cheap upper bounds on ratio() first: from the lengths (as
+        # real_quick_ratio, without building the matcher), then quick_ratio
+        if 2.0 * min(len(a), len(b)) / (len(a) + len(b)) < NAME_SIMILARITY:
+            return False
+        if self._matcher is None:
+            self._matcher = SequenceMatcher(None, b=b)
+        m = self._matcher
+        m.set_seq1(a)
+        return m.quick_ratio() >= NAME_SIMILARITY and m.ratio() >= NAME_SIMILARITY
+
+
+def similar_names(a, b):
+    '''Whether two (normalized) names are close enough to be the same hut,
+    given that the huts are close together.'''
+    return _NameMatcher(b).similar(a)
+
+
+class _Grid(object):
+
+    def __init__(self, cell_km):
+        self.d_lat = cell_km / KM_PER_DEGREE_LAT
+        self.d_lng = cell_km / (KM_PER_DEGREE_LAT * MIN_COS_LAT)
+        self.cells = {}
+
+    def _cell(self, h):
+        return (int(math.floor(h.lat / self.d_lat)), int(math.floor(h.lng / self.d_lng)))
+
+    def add(self, h):
+        self.cells.setdefault(self._cell(h), []).append(h)
+
+    def near(self, h):
+        '''The huts in h's cell and the cells around it that are no more than
+        a cell away from h in either direction.'''
+        result = []
+        if not self.cells:
+            return result
+        lat, lng = h.lat, h.lng
+        lat_cell, lng_cell = self._cell(h)
+        for i in (-1, 0, 1):
+            for j in (-1, 0, 1):
+                cell = self.cells.get((lat_cell + i, lng_cell + j))
+                if cell:
+                    result.extend(o for o in cell
+                                  if abs(o.lat - lat) <= self.d_lat and abs(o.lng - lng) <= self.d_lng)
+        return result
+
+
+def _within(h, others):
+    '''Yields (other, distance) for the others within DUPLICATE_DISTANCE_KM
+    of h.'''
+    from huts.geo import distance_km
+
+    for other in others:
+        distance = distance_km([h.lng, h.lat], [other.lng, other.lat])
+        if distance <= DUPLICATE_DISTANCE_KM:
+            yield other, distance
+
+
+def federate(sources):
+    '''Merges the huts from sources (earlier sources win), dropping
+    duplicates (see the module docstring). Returns (huts, duplicates), where
+    duplicates is a list of (hut kept, hut dropped, distance in km).'''
+    huts = []
+    duplicates = []
+    grid = _Grid(DUPLICATE_DISTANCE_KM)
+    # normalized names, by hut id, worked out when first needed
+    normalized = {}
+
+    def name(h):
+        if h.id not in normalized:
+            normalized[h.id] = normalize_name(h.name)
+        return normalized[h.id]
+
+    with instrument.stage('load: federate sources'):
+        for source in sources:
+            kept = []
+            for h in source.huts():
+                candidates = grid.near(h)
+                # the same name first, then similar names
+                same = [o for o in candidates if name(o) == name(h)]
+                matcher = _NameMatcher(name(h))
+                duplicate = (next(_within(h, same), None)
+                             or next(((o, d) for o, d in _within(h, candidates) if matcher.similar(name(o))), None))
+                if duplicate is None:
+                    kept.append(h)
+                else:
+                    other, distance = duplicate
+                    other.provenance.extend(h.provenance)
+                    duplicates.append((other, h, distance))
+            # only compare with the huts of earlier sources
+            for h in kept:
+                grid.add(h)
+            huts.extend(kept)
+    instrument.count('duplicate huts dropped', len(duplicates))
+    return huts, duplicates
+
+
+if __name__ == '__main__':
+    sources = default_sources()
+    huts, duplicates = federate(sources)
+    for source in sources:
+        print('{}: {} huts ({})'.format(
+            source.name, sum(1 for h in huts if h.provenance[0][0] == source.name), source.path))
+    print('Duplicates dropped ({}):'.format(len(duplicates)))
+    for kept, dropped, distance in duplicates:
+        print(u'    {} [{}] duplicates {} [{}], {:.2f} km apart'.format(
+            dropped.name, dropped.provenance[0][0], kept.name, kept.provenance[0][0], distance))
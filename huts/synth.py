@@ -0,0 +1,246 @@
+'''
+Generates synthetic hut catalogs (in the same GeoJSON format as
+data/DOC_Huts.geojson) and trip logs (in the same format as trips_raw), of any
+size, for benchmarking and scale testing.
+
+The distributions are taken from the real catalog: regions and places appear
+with their real frequencies, huts are scattered around real huts in the same
+region, names are recombined from real hut names, and facilities/bookable are
+copied from real huts. On top of that:
+  - some hut names are reused in other regions (like Pinnacles Hut), and the
+    trips visiting those huts disambiguate with HUT_REGION,
+  - some huts have no place (and so end up in unknown_place),
+  - some visits are multi-night stays, some are day visits, and some trips
+    pass through the same hut twice.
+
+Everything is derived from a seeded random.Random, so the output is
+reproducible.
+
+Usage:
+    PYTHONPATH=. python3 huts/synth.py --huts 100000 --trips 5000 -o synth/
+writes synth/DOC_Huts.geojson, synth/non_DOC_Huts.json and synth/trips.json.
+'''
+
+from collections import defaultdict
+from datetime import date, timedelta
+import json
+import os
+import random
+
+from huts.hut import DOC_HUTS_FILE, OVERRIDE_PLACE_FILE, OVERRIDE_REGION_FILE
+from huts.trips import (
+    TRIP_START, TRIP_END, TRIP_DESC, TRIP_PARTY, TRIP_REPORTS, TRIP_HUTS,
+    HUT_NAME, HUT_REGION, HUT_ARRIVAL, HUT_SLEEP, HUT_MULTIPLE_NIGHTS,
+)
+
+DUPLICATE_NAME_RATE = 0.02
+UNKNOWN_PLACE_RATE = 0.01
+MULTIPLE_NIGHTS_RATE = 0.1
+NO_SLEEP_RATE = 0.4
+REVISIT_RATE = 0.1
+# roughly how far (in degrees) a synthetic hut may be from the real hut it's
+# scattered around
+JITTER = 0.1
+
+FIRST_TRIP = date(2010, 1, 1)
+LAST_TRIP = date(2025, 12, 31)
+
+
+class _RealCatalog(object):
+    '''The distributions taken from the real catalog.'''
+
+    def __init__(self):
+        with open(DOC_HUTS_FILE) as f:
+            self.features = json.load(f)['features']
+        with open(OVERRIDE_PLACE_FILE) as f:
+            self.reserved_names = set(json.load(f))
+        with open(OVERRIDE_REGION_FILE) as f:
+            self.reserved_names.update(json.load(f))
+
+        # e.g. "Bull Creek Hut" -> first words "Bull", "Creek"; suffix "Hut"
+        self.words = []
+        self.suffixes = []
+        for feature in self.features:
+            name = feature['properties']['name'].split()
+            self.words.extend(name[:-1])
+            self.suffixes.append(name[-1])
+        self.words = [w for w in self.words if w.isalpha()]
+
+
+def _name(rng, real):
+    return u'{} {} {}'.format(rng.choice(real.words), rng.choice(real.words), rng.choice(real.suffixes))
+
+
+def catalog(num_huts, seed=0):
+    '''Returns a GeoJSON FeatureCollection (as a dict) of num_huts synthetic
+    huts.'''
+    rng = random.Random(seed)
+    real = _RealCatalog()
+
+    names_by_region = defaultdict(set)
+    all_names = []
+    features = []
+    for i in range(num_huts):
+        template = rng.choice(real.features)
+        props = template['properties']
+        region = props['region']
+
+        name = None
+        if all_names and rng.random() < DUPLICATE_NAME_RATE:
+            candidate = rng.choice(all_names)
+            if candidate not in names_by_region[region]:
+                name = candidate
+        while name is None or name in names_by_region[region] or name in real.reserved_names:
+            name = _name(rng, real)
+        names_by_region[region].add(name)
+        all_names.append(name)
+
+        place = props['place']
+        if rng.random() < UNKNOWN_PLACE_RATE:
+            place = None
+
+        lng, lat = template['geometry']['coordinates']
+        object_id = i + 1
+        features.append({
+            'type': 'Feature',
+            'properties': {
+                'OBJECTID': object_id,
+                'name': name,
+                'place': place,
+                'region': region,
+                'bookable': props['bookable'],
+                'facilities': props['facilities'],
+                'hasAlerts': props['hasAlerts'],
+                'introductionThumbnail': 'https://example.com/thumbs/{}.jpg'.format(object_id),
+                'staticLink': 'https://example.com/huts/{}'.format(object_id),
+                'locationString': place,
+                'assetId': 200000000 + object_id,
+                'GlobalID': '{{{:08X}-0000-4000-8000-{:012X}}}'.format(seed, object_id),
+            },
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [
+                    lng + rng.uniform(-JITTER, JITTER),
+                    lat + rng.uniform(-JITTER, JITTER),
+                ],
+            },
+        })
+
+    return {
+        'type': 'FeatureCollection',
+        'name': 'Synthetic_DOC_Huts',
+        'features': features,
+    }
+
+
+def trips(huts_geojson, num_trips, seed=0, max_huts_per_trip=6):
+    '''Returns num_trips synthetic trips (in the trips_raw format) visiting
+    the huts in huts_geojson. Each trip stays within one region.'''
+    rng = random.Random(seed)
+
+    names = defaultdict(int)
+    huts_by_region = defaultdict(list)
+    for feature in huts_geojson['features']:
+        props = feature['properties']
+        names[props['name']] += 1
+        huts_by_region[props['region']].append(props['name'])
+    regions = list(huts_by_region)
+
+    result = []
+    for i in range(num_trips):
+        region = rng.choice(regions)
+        huts = huts_by_region[region]
+        route = rng.sample(huts, min(len(huts), rng.randint(1, max_huts_per_trip)))
+        if len(route) > 1 and rng.random() < REVISIT_RATE:
+            route.append(route[0]) # out and back
+
+        start = FIRST_TRIP + timedelta(days=rng.randrange((LAST_TRIP - FIRST_TRIP).days))
+        arrival = start
+        hut_visits = []
+        for name in route:
+            hv = {
+                HUT_ARRIVAL: arrival,
+                HUT_SLEEP: rng.random() >= NO_SLEEP_RATE,
+                HUT_NAME: name,
+            }
+            if names[name] > 1:
+                hv[HUT_REGION] = region
+            nights = 1
+            if hv[HUT_SLEEP] and rng.random() < MULTIPLE_NIGHTS_RATE:
+                nights = rng.randint(2, 4)
+                hv[HUT_MULTIPLE_NIGHTS] = nights
+            if hv[HUT_SLEEP]:
+                arrival += timedelta(days=nights)
+            hut_visits.append(hv)
+
+        result.append({
+            TRIP_START: start,
+            TRIP_END: max(arrival, start),
+            TRIP_DESC: 'Synthetic trip {}'.format(i + 1),
+            TRIP_REPORTS: ['https://example.com/reports/{}/{}'.format(i + 1, r)
+                           for r in range(rng.randint(0, 2))],
+            TRIP_PARTY: ['Person {}'.format(rng.randrange(100)) for _ in range(rng.randint(0, 3))],
+            TRIP_HUTS: hut_visits,
+        })
+
+    result.sort(key=lambda t: t[TRIP_START])
+    return result
+
+
+def trips_to_json(trips_raw):
+    '''trips_raw uses date objects; convert them to ISO strings.'''
+    def convert(obj):
+        if isinstance(obj, date):
+            return obj.isoformat()
+        if isinstance(obj, dict):
+            return {k: convert(v) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [convert(v) for v in obj]
+        return obj
+    return convert(trips_raw)
+
+
+def trips_from_json(obj):
+    '''Inverse of trips_to_json.'''
+    result = []
+    for t in obj:
+        t = dict(t)
+        t[TRIP_START] = date.fromisoformat(t[TRIP_START])
+        t[TRIP_END] = date.fromisoformat(t[TRIP_END])
+        t[TRIP_HUTS] = [dict(hv, **{HUT_ARRIVAL: date.fromisoformat(hv[HUT_ARRIVAL])})
+                        for hv in t.get(TRIP_HUTS, [])]
+        result.append(t)
+    return result
+
+
+def write_dataset(out_dir, num_huts, num_trips, seed=0):
+    '''Writes DOC_Huts.geojson, non_DOC_Huts.json (empty) and trips.json to
+    out_dir. Returns (doc_huts_file, non_doc_huts_file, trips_raw).'''
+    os.makedirs(out_dir, exist_ok=True)
+    huts_geojson = catalog(num_huts, seed)
+    trips_raw = trips(huts_geojson, num_trips, seed)
+
+    doc_huts_file = os.path.join(out_dir, 'DOC_Huts.geojson')
+    with open(doc_huts_file, 'w') as f:
+        json.dump(huts_geojson, f)
+    non_doc_huts_file = os.path.join(out_dir, 'non_DOC_Huts.json')
+    with open(non_doc_huts_file, 'w') as f:
+        json.dump([], f)
+    with open(os.path.join(out_dir, 'trips.json'), 'w') as f:
+        json.dump(trips_to_json(trips_raw), f)
+
+    return doc_huts_file, non_doc_huts_file, trips_raw
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic hut catalog and trip log.')
+    parser.add_argument('--huts', type=int, required=True)
+    parser.add_argument('--trips', type=int, required=True)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', required=True, help='output directory')
+    args = parser.parse_args()
+
+    write_dataset(args.output, args.huts, args.trips, args.seed)
+    print('Wrote {} huts and {} trips to directory: {}'.format(args.huts, args.trips, args.output))
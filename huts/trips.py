@@ -938,6 +938,13 @@ class Trip(object):
         t.hut_visits = tuple([HutVisit.from_dict(hv) for hv in dict_.get(TRIP_HUTS, [])])
         return t
 
+    def key(self):
+        '''A hashable summary of everything about the trip. Trips parsed
+        from identical dicts have equal keys, so they can be matched up across
+        reloads of this module.'''
+        return (self.start, self.end, self.desc, self.party, self.aborted, self.reports,
+                tuple(hv.key() for hv in self.hut_visits))
+
     def __str__(self):
         return 'Trip: {}'.format(self.desc)
 
@@ -951,13 +958,22 @@ class HutVisit(object):
         hv.arrival = dict_[HUT_ARRIVAL]
         hv.num_days = dict_.get(HUT_MULTIPLE_NIGHTS, 1)
         hv.sleep = dict_[HUT_SLEEP]
+        # the id of the hut, once resolved (see huts.hut.Catalog)
+        hv.hut_id = None
         return hv
 
+    def key(self):
+        return (self.name, self.region, self.arrival, self.num_days, self.sleep)
+
     def __str__(self):
         return 'HutVisit: {}'.format(self.name)
 
-def all_trips():
-    return [Trip.from_dict(t) for t in trips_raw]
+def all_trips(raw=None):
+    '''raw defaults to trips_raw, but any list of dicts in the same format may
+    be passed in.'''
+    if raw is None:
+        raw = trips_raw
+    return [Trip.from_dict(t) for t in raw]
 
 def all_hut_visits():
     result = []
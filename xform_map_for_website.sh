@@ -39,6 +39,7 @@ cat "$raw_map" | tail -n +$(($map_style_start_line + 3)) | head -n $(($map_style
 echo '    <link rel="stylesheet" href="/assets/css/styles.css">'
 echo '    <style>body{max-width: unset; margin-left: unset;}</style>'
 echo '    <style>#summaryzone{margin-left: 70%; padding-left: 5px;}</style>'
+echo '    <style>ul.checklist, ul.checklist ul {list-style: none; padding-left: 2em;}</style>'
 cat "$raw_map" | tail -n +$(($map_style_end_line + 1)) | head -n $(($map_div_line - $map_style_end_line - 1))
 echo "    <div class=\"folium-map\" id=\"${map_identifier}\"></div>"
 echo '    <div id="summaryzone"></div>'
@@ -49,6 +50,10 @@ EOF
 echo "$map_identifier.on('overlayadd', function(overlay) {"
 cat <<'EOF'
 	$('#summaryzone').html(checklist_data[overlay.name.split(' - ')[0]]);
+	// layers split out of the page (see huts.map.layer_shards) are fetched the first time they're shown
+	if (typeof load_hut_layer === 'function') {
+		load_hut_layer(overlay);
+	}
 	return true;
 });
 </script>